@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Branch, Subject, Note, Bookmark, Comment
+from .models import Branch, Subject, Note, Bookmark, Comment, Job
 
 
 @admin.register(Branch)
@@ -33,3 +33,10 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ('user', 'note', 'text', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('text', 'user__username')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'key', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status', 'task')
+    search_fields = ('key',)
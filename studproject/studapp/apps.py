@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class StudappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'studapp'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .dbprofile import apply_profile
+        connection_created.connect(apply_profile, dispatch_uid='studapp.dbprofile')
+        from .metrics import install_sql_timer
+        connection_created.connect(install_sql_timer, dispatch_uid='studapp.metrics')
+
+        from . import signals  # noqa: F401 — connects the receivers
+        from . import tasks  # noqa: F401 — registers the job handlers
@@ -0,0 +1,60 @@
+"""Cached per-user bookmark state for note listings.
+
+Listings only need to know which of the notes on the page are bookmarked,
+so membership is looked up for those note IDs alone and cached per page.
+Each user's entries carry a version number; `invalidate` bumps it whenever
+the user's bookmarks change (see studapp.signals) and the old entries
+simply age out.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .models import Bookmark
+
+ENTRY_TIMEOUT = 24 * 60 * 60
+
+
+def _version_key(user_id):
+    return f'bookmarks:{user_id}:version'
+
+
+def _version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = invalidate(user_id)
+    return version
+
+
+def bookmarked_among(user_id, note_ids):
+    """The subset of `note_ids` the user has bookmarked, as a set (one query on a cache miss)."""
+    note_ids = sorted(set(note_ids))
+    if not note_ids:
+        return set()
+    digest = hashlib.md5(','.join(map(str, note_ids)).encode()).hexdigest()
+    key = f'bookmarks:{user_id}:{_version(user_id)}:{digest}'
+    bookmarked = cache.get(key)
+    if bookmarked is None:
+        bookmarked = set(
+            Bookmark.objects.filter(user_id=user_id, note_id__in=note_ids).values_list('note_id', flat=True)
+        )
+        cache.set(key, bookmarked, ENTRY_TIMEOUT)
+    return bookmarked
+
+
+def count(user_id):
+    """How many notes the user has bookmarked."""
+    key = f'bookmarks:{user_id}:{_version(user_id)}:count'
+    total = cache.get(key)
+    if total is None:
+        total = Bookmark.objects.filter(user_id=user_id).count()
+        cache.set(key, total, ENTRY_TIMEOUT)
+    return total
+
+
+def invalidate(user_id):
+    """Bump the user's version so every cached entry for them is ignored."""
+    version = time.time_ns()
+    cache.set(_version_key(user_id), version, None)
+    return version
@@ -1,6 +1,6 @@
-from studapp.models import Branch
+from studapp.navigation import get_tree
 
 
 def branches_context(request):
-    """Make branches available in every template (for footer links)."""
-    return {'branches': Branch.objects.all()}
+    """Make the cached branch → subject tree available in every template."""
+    return {'branches': get_tree()}
@@ -0,0 +1,163 @@
+"""Download counters and stored count columns.
+
+Downloads are counted in memory and written back in batches as
+`downloads = downloads + n` updates, so a burst of downloads costs one
+short write transaction instead of one read-modify-write per request.
+Every worker process keeps its own buffer; because the flush is a relative
+update, buffers from several processes add up correctly in the database.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCounter:
+    """In-process buffer of pending `Note.downloads` increments."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._pid = os.getpid()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    @property
+    def interval(self):
+        """Seconds between flushes. 0 writes every increment straight through."""
+        return getattr(settings, 'DOWNLOAD_COUNTER_FLUSH_INTERVAL', 5)
+
+    def increment(self, note_id, amount=1):
+        with self._lock:
+            self._check_fork()
+            self._pending[note_id] += amount
+            due = time.monotonic() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+        else:
+            self._ensure_timer()
+
+    def pending(self, note_id):
+        """Increments for `note_id` not yet written to the database."""
+        with self._lock:
+            return self._pending.get(note_id, 0)
+
+    def flush(self):
+        """Write all buffered increments. Returns the number of notes updated."""
+        with self._lock:
+            self._check_fork()
+            batch, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+
+        # One UPDATE per distinct increment size, not one per note
+        by_amount = defaultdict(list)
+        for note_id, amount in batch.items():
+            by_amount[amount].append(note_id)
+
+        from .models import Note
+        try:
+            with transaction.atomic():
+                for amount, note_ids in by_amount.items():
+                    Note.objects.filter(id__in=note_ids).update(downloads=F('downloads') + amount)
+        except Exception:
+            logger.exception('Could not flush download counters; keeping them for the next flush')
+            with self._lock:
+                self._pending.update(batch)
+            return 0
+        return len(batch)
+
+    def _check_fork(self):
+        # A pre-forking server copies the parent's buffer and timer into each
+        # child; the child must start empty or the parent's counts double up.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = Counter()
+            self._timer = None
+
+    def _ensure_timer(self):
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Thread(target=self._run_timer, name='download-counter-flush', daemon=True)
+            self._timer.start()
+
+    def _run_timer(self):
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.flush()
+                with self._lock:
+                    if not self._pending:
+                        self._timer = None
+                        return
+        finally:
+            connection.close()
+
+
+download_counter = DownloadCounter()
+
+# Flush whatever is left when the worker process shuts down
+atexit.register(download_counter.flush)
+
+
+# --------------- Denormalized counts ---------------
+# Note.comment_count / bookmark_count and Subject/Branch.note_count are
+# stored columns. Receivers in studapp.signals adjust them on post_save and
+# post_delete of each row, so admin edits and cascades count too; callers
+# wrap the write in a transaction so the row and its counter commit
+# together. bulk_create and raw SQL skip signals; `recount_all` repairs
+# any drift they leave.
+
+def _adjust(queryset, field, delta):
+    if delta < 0:
+        # Never push a PositiveIntegerField below zero
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def adjust_comment_count(note_id, delta):
+    from .models import Note
+    _adjust(Note.objects.filter(id=note_id), 'comment_count', delta)
+
+
+def adjust_bookmark_count(note_id, delta):
+    from .models import Note
+    _adjust(Note.objects.filter(id=note_id), 'bookmark_count', delta)
+
+
+def adjust_note_count(subject_id, delta):
+    """Count a note added to (+1) or removed from (-1) a subject and its branch."""
+    from .models import Branch, Subject
+    _adjust(Subject.objects.filter(id=subject_id), 'note_count', delta)
+    _adjust(Branch.objects.filter(subjects__id=subject_id), 'note_count', delta)
+
+
+def _count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(n=Count('pk')).values('n')
+    ), Value(0))
+
+
+def recount_all():
+    """Recompute every stored counter from the source rows, in bulk."""
+    from .models import Bookmark, Branch, Comment, Note, Subject
+    with transaction.atomic():
+        notes = Note.objects.update(
+            comment_count=_count_of(Comment, 'note'),
+            bookmark_count=_count_of(Bookmark, 'note'),
+        )
+        subjects = Subject.objects.update(note_count=_count_of(Note, 'subject'))
+        branches = Branch.objects.update(note_count=_count_of(Note, 'subject__branch'))
+    return notes, subjects, branches
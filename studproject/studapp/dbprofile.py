@@ -0,0 +1,113 @@
+"""SQLite connection profile: WAL, pragmas on connect and retries when the database is busy.
+
+WAL lets readers and one writer work at the same time. The journal mode
+is stored in the database file, so it's switched once, by migration 0019
+(`set_journal_mode`), not on every connection: that would rewrite any
+database a management command happens to open.
+
+Every new SQLite connection gets the DATABASE_PROFILE pragmas, applied on
+`connection_created`. busy_timeout makes SQLite wait for a lock instead of
+failing at once. mmap_size and cache_size keep hot pages in memory. The
+read-only alias (see studapp.routers) skips the pragmas that need write
+access.
+
+Writes on the default alias also go through `retry_on_busy`. If a lock is
+still held after busy_timeout, the statement is retried with backoff. This
+only happens where a retry is safe: a BEGIN, or a statement run in
+autocommit mode.
+"""
+import logging
+import random
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODE = 'wal'
+DEFAULT_PROFILE = {
+    'synchronous': 'normal',      # safe with WAL; fsync at checkpoints, not every commit
+    'busy_timeout': 5000,         # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,         # negative = KiB, so 64 MB per connection
+    'temp_store': 'memory',
+    'foreign_keys': 'on',
+}
+# Pragmas that write to the database file (if set in DATABASE_PROFILE); a read-only connection can't run them
+WRITE_PRAGMAS = ('journal_mode',)
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.05  # seconds; doubles on each attempt
+
+
+def get_profile():
+    """DEFAULT_PROFILE with settings.DATABASE_PROFILE on top; None values drop a pragma."""
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(getattr(settings, 'DATABASE_PROFILE', {}))
+    return {name: value for name, value in profile.items() if value is not None}
+
+
+def pragma_statements(read_only=False, profile=None):
+    profile = get_profile() if profile is None else profile
+    return [
+        f'PRAGMA {name} = {value}'
+        for name, value in profile.items()
+        if not (read_only and name in WRITE_PRAGMAS)
+    ]
+
+
+def is_read_only(connection):
+    name = str(connection.settings_dict.get('NAME', ''))
+    return 'mode=ro' in name or connection.alias == getattr(settings, 'DATABASE_READ_ALIAS', 'readonly')
+
+
+def set_journal_mode(connection, mode=JOURNAL_MODE):
+    """Switch the database file to `mode`; returns the mode SQLite reports.
+
+    Can't run inside a transaction. An in-memory database stays 'memory'.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {mode}')
+        return cursor.fetchone()[0]
+
+
+def apply_profile(sender, connection, **kwargs):
+    """`connection_created` receiver: set the pragmas and install the busy retry."""
+    if connection.vendor != 'sqlite' or not getattr(settings, 'DATABASE_PROFILE_ENABLED', True):
+        return
+    read_only = is_read_only(connection)
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(read_only):
+            cursor.execute(statement)
+    if not read_only and retry_on_busy not in connection.execute_wrappers:
+        connection.execute_wrappers.append(retry_on_busy)
+
+
+def is_busy_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def call_with_retry(func, *args, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY):
+    """Call `func(*args)`, retrying with jittered backoff while SQLite reports it's busy."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args)
+        except (OperationalError, sqlite3.OperationalError) as exc:
+            if not is_busy_error(exc) or attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning('Database busy, retrying in %.2fs (attempt %s/%s)', delay, attempt, attempts)
+            time.sleep(delay)
+
+
+def retry_on_busy(execute, sql, params, many, context):
+    """Execute wrapper for the default alias; see the module docstring."""
+    connection = context['connection']
+    starts_transaction = sql.lstrip()[:5].upper() == 'BEGIN'
+    if connection.in_atomic_block and not starts_transaction:
+        # Mid-transaction the caller must retry the whole block, not one statement
+        return execute(sql, params, many, context)
+    return call_with_retry(execute, sql, params, many, context)
@@ -0,0 +1,358 @@
+"""HTTP delivery of note files: validators, conditional GET and byte ranges.
+
+With `FILE_DELIVERY_MODE` set, the bytes are not sent by Django at all:
+the view answers with an internal-redirect header and the front-end web
+server (nginx `X-Accel-Redirect`, Apache/lighttpd `X-Sendfile`) does the
+transfer, including ranges. Under ASGI, bodies are async iterators fed
+from a worker thread (see `aiter_chunks`), so a slow download doesn't tie
+up a thread.
+"""
+import asyncio
+import codecs
+import hashlib
+import html
+import mimetypes
+import re
+import uuid
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+STREAM_READ_AHEAD = 4  # chunks an async stream may read ahead of the client
+MAX_RANGES = 16  # more than this and we just send the whole file
+DELIVERY_MODES = ('x-accel-redirect', 'x-sendfile')
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+
+
+def file_etag(note):
+    """Strong ETag from the file's identity (its content-addressed name) and updated_at."""
+    raw = f'{note.file.name}:{note.updated_at.timestamp()}'
+    return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+
+def parse_range_header(header, size):
+    """Parse `Range: bytes=...` into a list of (start, end) inclusive pairs.
+
+    Returns None when the header should be ignored (absent, malformed, not
+    bytes, too many ranges) and [] when no range is satisfiable.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = RANGE_RE.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0 or size == 0:
+                continue  # nothing to send; an empty file satisfies no range
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+    return ranges
+
+
+def _if_range_matches(request, etag, last_modified):
+    """A stale If-Range validator means the client gets the whole file instead."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag  # strong comparison only
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def _read_range(fileobj, start, end):
+    fileobj.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _single_part(fileobj, start, end):
+    try:
+        yield from _read_range(fileobj, start, end)
+    finally:
+        fileobj.close()
+
+
+def _multipart(fileobj, ranges, size, content_type, boundary):
+    try:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            yield from _read_range(fileobj, start, end)
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        fileobj.close()
+
+
+def delivery_mode():
+    """'x-accel-redirect', 'x-sendfile', or None to stream in-process."""
+    mode = getattr(settings, 'FILE_DELIVERY_MODE', None)
+    if not mode:
+        return None
+    if mode.lower() not in DELIVERY_MODES:
+        raise ImproperlyConfigured(
+            f'FILE_DELIVERY_MODE must be one of {", ".join(DELIVERY_MODES)} or unset, not {mode!r}.'
+        )
+    return mode.lower()
+
+
+def offload_response(request, note, as_attachment, content_type, validators):
+    """Hand the transfer to the front-end server via an internal-redirect header."""
+    response = HttpResponse(content_type=content_type)
+    if delivery_mode() == 'x-sendfile':
+        response['X-Sendfile'] = note.file.path
+    else:
+        prefix = getattr(settings, 'FILE_DELIVERY_INTERNAL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(note.file.name)
+    response['Content-Disposition'] = content_disposition_header(as_attachment, note.download_name)
+    for header, value in validators.items():
+        response[header] = value
+    # The front end answers the Range itself; only a GET from byte 0 is a new download
+    ranges = parse_range_header(request.META.get('HTTP_RANGE'), note.file.size)
+    response.is_new_download = request.method == 'GET' and (not ranges or ranges[0][0] == 0)
+    return response
+
+
+def serve_note_file(request, note, as_attachment=False):
+    """Serve `note.file` with ETag/Last-Modified, 304s and 206 byte ranges.
+
+    The response carries `is_new_download`: False for 304s and for range
+    requests that resume mid-file, so callers don't count those twice.
+    Raises FileNotFoundError if the file is missing.
+    """
+    etag = file_etag(note)
+    last_modified = note.updated_at.timestamp()
+    validators = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Accept-Ranges': 'bytes'}
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if conditional is not None:
+        for header, value in validators.items():
+            conditional.headers.setdefault(header, value)
+        conditional.is_new_download = False
+        return conditional
+
+    content_type = mimetypes.guess_type(note.download_name)[0] or 'application/octet-stream'
+    if delivery_mode():
+        if not note.file.storage.exists(note.file.name):
+            raise FileNotFoundError(note.file.name)
+        return offload_response(request, note, as_attachment, content_type, validators)
+
+    fileobj = note.file.open('rb')
+    size = note.file.size
+
+    ranges = None
+    if request.method == 'GET' and _if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    if ranges is None:
+        response = FileResponse(fileobj, as_attachment=as_attachment, filename=note.download_name)
+        response.block_size = CHUNK_SIZE  # Django's default is 4 KiB
+        if streams_async(request):
+            response.streaming_content = aiter_chunks(_single_part(fileobj, 0, size - 1))
+        response.is_new_download = request.method == 'GET'  # not HEAD
+    elif not ranges:
+        fileobj.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        response.is_new_download = False
+        return response
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            _body(request, _single_part(fileobj, start, end)), status=206, content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        response.is_new_download = start == 0
+    else:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            _body(request, _multipart(fileobj, ranges, size, content_type, boundary)),
+            status=206, content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response.is_new_download = ranges[0][0] == 0
+
+    for header, value in validators.items():
+        response[header] = value
+    if response.status_code == 206:
+        response['Content-Disposition'] = content_disposition_header(as_attachment, note.download_name)
+    return response
+
+
+# --------------- Text previews ---------------
+
+def _text_preview_chunks(fileobj, size, offset, max_bytes, max_lines, continue_url):
+    """Yield escaped HTML for the file from `offset`, stopping at either cap."""
+    fallback = getattr(settings, 'TEXT_PREVIEW_FALLBACK_ENCODING', 'latin-1')
+    decoder = None
+    consumed = lines = 0
+    try:
+        fileobj.seek(offset)
+        yield (
+            '<body style="margin:0;padding:20px;background:#0f172a;color:#f8fafc;font-family:monospace" '
+            'oncontextmenu="return false"><pre>'
+        )
+        while consumed < max_bytes and lines < max_lines:
+            chunk = fileobj.read(min(CHUNK_SIZE, max_bytes - consumed))
+            if not chunk:
+                break
+            if decoder is None:
+                # A later page may start in the middle of a UTF-8 sequence
+                skip = len(chunk) - len(chunk.lstrip(UTF8_CONTINUATION)) if offset else 0
+                encoding = _pick_encoding(chunk[skip:], fallback)
+                if encoding == 'utf-8':
+                    chunk, consumed = chunk[skip:], skip
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            remaining_lines = max_lines - lines
+            if chunk.count(b'\n') >= remaining_lines:
+                # Cut just after the last line we're allowed to show
+                cut = -1
+                for _ in range(remaining_lines):
+                    cut = chunk.index(b'\n', cut + 1)
+                chunk = chunk[:cut + 1]
+            lines += chunk.count(b'\n')
+            consumed += len(chunk)
+            yield html.escape(decoder.decode(chunk))
+
+        pending = 0
+        if decoder and offset + consumed >= size:
+            # A sequence the file ends in the middle of is shown as U+FFFD
+            yield html.escape(decoder.decode(b'', final=True))
+        elif decoder:
+            # Bytes of a half-read character are re-read by the next page
+            pending = len(decoder.getstate()[0])
+        yield '</pre>'
+
+        next_offset = offset + consumed - pending
+        if next_offset < size:
+            yield (
+                f'<p><a href="{continue_url}?offset={next_offset}" '
+                f'style="color:#a78bfa;font-family:sans-serif">Load more ↓</a></p>'
+            )
+        yield '</body>'
+    finally:
+        fileobj.close()
+
+
+def _pick_encoding(first_chunk, fallback):
+    """UTF-8 if the first chunk decodes as such, else the fallback encoding."""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(first_chunk, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return fallback
+
+
+def stream_text_preview(request, note, continue_url):
+    """Stream a size-capped, HTML-escaped text preview starting at `?offset=`."""
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+    max_bytes = getattr(settings, 'TEXT_PREVIEW_MAX_BYTES', 256 * 1024)
+    max_lines = getattr(settings, 'TEXT_PREVIEW_MAX_LINES', 5000)
+    fileobj = note.file.open('rb')
+    chunks = _text_preview_chunks(fileobj, note.file.size, offset, max_bytes, max_lines, continue_url)
+    return StreamingHttpResponse(_body(request, chunks), content_type='text/html; charset=utf-8')
+
+
+# --------------- Async streaming ---------------
+
+def streams_async(request):
+    """Whether the response body should be an async iterator.
+
+    Django bridges a mismatch (a sync body under ASGI, an async one under
+    WSGI) by reading the whole body into memory first, so the body has to
+    match the server the request came in through.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def _body(request, chunks):
+    return aiter_chunks(chunks) if streams_async(request) else chunks
+
+
+_producers = set()
+
+
+async def aiter_chunks(chunks, read_ahead=None):
+    """Yield from the blocking iterator `chunks` without blocking the event loop.
+
+    Reads run in worker threads, at most `read_ahead` chunks ahead of the
+    client. A slow client then holds no thread, and its stream buffers at
+    most read_ahead × CHUNK_SIZE bytes.
+    """
+    if read_ahead is None:
+        read_ahead = getattr(settings, 'STREAM_READ_AHEAD', STREAM_READ_AHEAD)
+    queue = asyncio.Queue(maxsize=max(read_ahead, 1))
+    done = object()
+    stopped = False
+    read = sync_to_async(next, thread_sensitive=False)
+
+    async def produce():
+        reading = False
+        try:
+            while not stopped:
+                reading = True
+                try:
+                    chunk = await read(chunks, done)
+                except Exception as exc:
+                    chunk = exc
+                reading = False
+                await queue.put(chunk)
+                if chunk is done or isinstance(chunk, Exception):
+                    break
+        finally:
+            # Closing a generator mid-read fails; if cancelled during a read,
+            # the generator closes its file when it's garbage-collected
+            if not reading and hasattr(chunks, 'close'):
+                chunks.close()
+
+    producer = asyncio.create_task(produce())
+    _producers.add(producer)  # the loop only keeps weak references to tasks
+    producer.add_done_callback(_producers.discard)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Done, or the client went away: the producer stops after the read
+        # in progress (draining unblocks it) and closes the file
+        stopped = True
+        while not queue.empty():
+            queue.get_nowait()
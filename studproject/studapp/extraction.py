@@ -0,0 +1,121 @@
+"""Text extraction from note files, for searching inside them.
+
+PDFs give one page of text per PDF page; text and source files are cut
+into pages of TEXT_PAGE_LINES lines. The pages go into the search index
+once per file name. Files are content-addressed (see studapp.storage), so
+the name is the content's identity, and a file that was already extracted
+is never read again. Extraction runs in the job worker (the `extract_text` task),
+never in a request.
+"""
+import codecs
+import logging
+
+from django.conf import settings
+
+from . import search
+from .models import ExtractedText, Job, Note
+
+try:
+    import pypdfium2
+except ImportError:  # pragma: no cover - optional dependency
+    pypdfium2 = None
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = (
+    'txt', 'md', 'rst', 'csv', 'tex', 'py', 'c', 'h', 'cpp', 'hpp', 'java', 'js', 'ts',
+    'html', 'css', 'sql', 'sh', 'go', 'rs', 'kt', 'm', 'r',
+)
+TEXT_PAGE_LINES = 60
+
+
+def _extension(name):
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def supports(note):
+    """Whether text can be pulled from this note's file type here."""
+    if not note.file:
+        return False
+    ext = _extension(note.file.name)
+    return ext in TEXT_EXTENSIONS or (ext == 'pdf' and pypdfium2 is not None)
+
+
+def job_key(note):
+    # Keyed on the stored file, so a re-uploaded file is extracted once
+    return _job_key(note.file.name)
+
+
+def _job_key(file_name):
+    return f'extract_text:{file_name}'
+
+
+def _pdf_pages(note):
+    pdf = pypdfium2.PdfDocument(note.file.path)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
+def _text_pages(note, max_chars):
+    fallback = getattr(settings, 'TEXT_PREVIEW_FALLBACK_ENCODING', 'latin-1')
+    read_limit = max_chars * 4  # enough bytes for max_chars in any UTF-8
+    with note.file.open('rb') as f:
+        raw = f.read(read_limit)
+    try:
+        text = codecs.decode(raw, 'utf-8')
+    except UnicodeDecodeError as exc:
+        # Cut mid-character at the read limit is fine; anything else isn't UTF-8
+        if len(raw) == read_limit and exc.start >= len(raw) - 3:
+            text = codecs.decode(raw[:exc.start], 'utf-8')
+        else:
+            text = codecs.decode(raw, fallback, errors='replace')
+    lines = text[:max_chars].splitlines(keepends=True)
+    return [''.join(lines[i:i + TEXT_PAGE_LINES]) for i in range(0, len(lines), TEXT_PAGE_LINES)]
+
+
+def extract_pages(note):
+    """The file's text as a list of pages, capped at TEXT_EXTRACT_MAX_CHARS in total."""
+    max_chars = getattr(settings, 'TEXT_EXTRACT_MAX_CHARS', 2_000_000)
+    if _extension(note.file.name) == 'pdf':
+        pages, total = [], 0
+        for text in _pdf_pages(note):
+            text = text.replace('\r\n', '\n')[:max_chars - total]
+            pages.append(text)
+            total += len(text)
+        return pages
+    return _text_pages(note, max_chars)
+
+
+def extract(note, force=False):
+    """Extract and index the text of `note`'s file unless that file was done before.
+
+    Returns True if the file was (re)extracted.
+    """
+    if not supports(note):
+        return False
+    name = note.file.name
+    if not force and ExtractedText.objects.filter(file=name).exists():
+        return False
+
+    pages = extract_pages(note)
+    ExtractedText.objects.update_or_create(file=name, defaults={'pages': len(pages)})
+    search.index_pages(name, pages)
+    logger.info('Extracted %s pages of text from %s', len(pages), name)
+    return True
+
+
+def release(file_name):
+    """Drop the text of `file_name` once no note uses that file any more."""
+    if file_name and not Note.objects.filter(file=file_name).exists():
+        ExtractedText.objects.filter(file=file_name).delete()
+        search.remove_pages(file_name)
+        # Let the same file be extracted again if it is ever re-uploaded
+        Job.objects.filter(key=_job_key(file_name)).delete()
@@ -147,6 +147,31 @@ class NoteUploadForm(forms.ModelForm):
         return f
 
 
+class UploadInitForm(NoteUploadForm):
+    """Note details plus the file's name and size, for starting a chunked upload."""
+    filename = forms.CharField(max_length=255)
+    size = forms.IntegerField(min_value=1)
+
+    class Meta(NoteUploadForm.Meta):
+        fields = ('title', 'description', 'subject')
+
+    def clean_filename(self):
+        # Browsers may send a path; only the base name is kept
+        name = self.cleaned_data.get('filename', '').replace('\\', '/').split('/')[-1].strip()
+        if not name:
+            raise forms.ValidationError('File name is required.')
+        return name
+
+    def clean_size(self):
+        """Reject files over the upload limit before any bytes are sent."""
+        size = self.cleaned_data.get('size')
+        from django.conf import settings
+        max_size = getattr(settings, 'MAX_UPLOAD_SIZE', 100 * 1024 * 1024)
+        if size and size > max_size:
+            raise forms.ValidationError(f'File too large! Max size is {max_size // (1024 * 1024)} MB.')
+        return size
+
+
 class CommentForm(forms.ModelForm):
     """Form for adding a comment to a note."""
     class Meta:
@@ -0,0 +1,171 @@
+"""A small database-backed job queue.
+
+Jobs are rows in `studapp.Job`; `manage.py run_jobs` claims and runs them.
+No broker is needed: claiming a job is a conditional UPDATE, which SQLite
+serialises, so several worker processes never run the same job twice.
+While a job runs, a heartbeat thread keeps its lock fresh, so only a job
+whose worker has died looks stale, however long the task takes.
+
+    @task('render_previews')
+    def render_previews(file): ...
+
+    enqueue_on_commit('render_previews', {'file': note.file.name})
+"""
+import hashlib
+import json
+import logging
+import random
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+BACKOFF_BASE = 10        # seconds before the first retry
+BACKOFF_MAX = 60 * 60    # never wait longer than an hour
+STALE_LOCK_AFTER = timedelta(minutes=30)  # a RUNNING job this old lost its worker
+HEARTBEAT_INTERVAL = timedelta(minutes=5)  # well inside STALE_LOCK_AFTER, even with a missed beat
+
+
+def task(name):
+    """Register a function as the handler for jobs named `name`."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def default_key(name, payload):
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f'{name}:{digest}'
+
+
+def enqueue(name, payload=None, key=None, max_attempts=5):
+    """Queue a job. A job with the same key is not queued twice; the existing one is returned."""
+    payload = payload or {}
+    key = key or default_key(name, payload)
+    # Most repeats find the job already queued: check without taking the write lock
+    existing = Job.objects.filter(key=key).first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            job, created = Job.objects.get_or_create(key=key, defaults={
+                'task': name,
+                'payload': payload,
+                'max_attempts': max_attempts,
+                'run_after': timezone.now(),
+            })
+    except IntegrityError:
+        # Lost a race with another process queueing the same key
+        job, created = Job.objects.get(key=key), False
+    if created and getattr(settings, 'JOB_QUEUE_EAGER', False):
+        run_job(job)
+    return job
+
+
+def enqueue_on_commit(name, payload=None, key=None, max_attempts=5):
+    """Queue a job once the surrounding transaction commits."""
+    transaction.on_commit(lambda: enqueue(name, payload, key, max_attempts))
+
+
+# --------------- Worker side ---------------
+
+def claim(worker_id):
+    """Take the next due job for `worker_id`, or None if nothing is due."""
+    now = timezone.now()
+    # Jobs whose worker died mid-run go back on the queue, unless that was
+    # their last attempt: a job that keeps killing its worker (say, running
+    # out of memory on a huge PDF) would otherwise be retried forever
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - STALE_LOCK_AFTER)
+    lost = {'locked_by': '', 'locked_at': None, 'updated_at': now, 'last_error': 'Worker stopped mid-run (lock expired)'}
+    stale.filter(attempts__gte=F('max_attempts')).update(status=Job.FAILED, **lost)
+    stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, **lost)
+
+    candidates = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker_id, locked_at=now, updated_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def backoff(attempts):
+    """Exponential delay with jitter before retry number `attempts`."""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def heartbeat(job):
+    """Refresh the lock of a running job. False if the job is no longer ours."""
+    now = timezone.now()
+    return bool(Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by).update(
+        locked_at=now, updated_at=now,
+    ))
+
+
+@contextmanager
+def _heartbeat(job):
+    """Call heartbeat(job) every HEARTBEAT_INTERVAL from a thread while the block runs."""
+    if not job.locked_by:  # run eagerly, not claimed
+        yield
+        return
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL.total_seconds()):
+                try:
+                    heartbeat(job)
+                except DatabaseError as exc:
+                    # e.g. the task holds the write lock for longer than busy_timeout; try next beat
+                    logger.warning('Job %s heartbeat failed: %s', job.id, exc)
+        finally:
+            connection.close()  # this thread's own connection
+
+    thread = threading.Thread(target=beat, name=f'job-{job.id}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """Run a claimed (or eagerly queued) job and record the outcome."""
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise LookupError(f'No task registered as {job.task!r}')
+        with _heartbeat(job):
+            func(**job.payload)
+    except Exception:
+        attempts = max(job.attempts, 1)
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.id, job.task, attempts)
+        if attempts < job.max_attempts:
+            _release(job, Job.QUEUED, last_error=error, run_after=timezone.now() + backoff(attempts))
+        else:
+            _release(job, Job.FAILED, last_error=error)
+        return False
+    _release(job, Job.DONE, last_error='')
+    return True
+
+
+def _release(job, status, **fields):
+    Job.objects.filter(id=job.id).update(
+        status=status, locked_by='', locked_at=None, updated_at=timezone.now(), **fields,
+    )
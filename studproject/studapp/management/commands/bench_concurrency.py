@@ -0,0 +1,189 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from studapp.models import Note
+
+
+class Stats:
+    """Per-run bookkeeping: time to first byte, completions, streams open at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.first_byte = []
+        self.finished = []
+        self.open_streams = self.peak_streams = 0
+        self.peak_threads = threading.active_count()
+        self.failures = 0
+
+    def stream_opened(self, began):
+        with self.lock:
+            self.first_byte.append(time.perf_counter() - began)
+            self.open_streams += 1
+            self.peak_streams = max(self.peak_streams, self.open_streams)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def stream_closed(self, began, status):
+        with self.lock:
+            self.open_streams -= 1
+            self.finished.append(time.perf_counter() - began)
+            if status >= 400:
+                self.failures += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare how many slow downloads WSGI (a fixed thread pool) and ASGI (one event loop) '
+        'keep in flight at once. Drives both handlers in-process; use a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help='Concurrent clients (default 200)')
+        parser.add_argument(
+            '--threads', type=int, default=16,
+            help='WSGI worker threads, like gunicorn --threads (default 16)',
+        )
+        parser.add_argument(
+            '--client-delay', type=float, default=0.01,
+            help='Seconds each client waits between chunks, to simulate a slow link (default 0.01)',
+        )
+        parser.add_argument('--note', type=int, help='Note to download (default: the first one with a file)')
+        parser.add_argument('--only', choices=['wsgi', 'asgi'], help='Run just one of the two')
+
+    def handle(self, *args, **options):
+        note = Note.objects.filter(id=options['note']) if options['note'] else Note.objects.exclude(file='')
+        note = note.first()
+        if note is None:
+            raise CommandError('No note with a file found. Upload one or run seed_benchmark_data first.')
+        user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('No users found. Run seed_benchmark_data first.')
+
+        setup_test_environment()  # lets requests for 'testserver' through ALLOWED_HOSTS
+        try:
+            cookie = self.session_cookie(user)
+            url = reverse('download', args=[note.id])
+            self.stdout.write(
+                f'GET {url} ({note.file.size:,} bytes) × {options["clients"]} clients, '
+                f'{options["client_delay"] * 1000:.0f} ms between chunks\n'
+            )
+            self.stdout.write(
+                f'{"server":<8}{"wall s":>8}{"TTFB p50":>10}{"TTFB p95":>10}{"done p95":>10}'
+                f'{"streams":>9}{"threads":>9}{"errors":>8}'
+            )
+            if options['only'] != 'asgi':
+                self.report('wsgi', self.run_wsgi(url, cookie, options))
+            if options['only'] != 'wsgi':
+                self.report('asgi', asyncio.run(self.run_asgi(url, cookie, options)))
+        finally:
+            teardown_test_environment()
+        self.stdout.write(
+            '\n"streams" is the most downloads that were in progress at the same moment; '
+            'under WSGI it cannot exceed --threads.'
+        )
+
+    def session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    # --------------- WSGI ---------------
+
+    def run_wsgi(self, url, cookie, options):
+        application = get_wsgi_application()
+        factory = RequestFactory()
+        stats = Stats()
+
+        def client(began):
+            environ = factory.get(url, HTTP_COOKIE=cookie).environ
+            status = []
+            body = application(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+            try:
+                opened = False
+                for _ in body:
+                    if not opened:
+                        stats.stream_opened(began)
+                        opened = True
+                    time.sleep(options['client_delay'])  # the worker thread waits on the slow client
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            if not opened:
+                stats.stream_opened(began)
+            stats.stream_closed(began, status[0])
+
+        # Like a threaded WSGI server: each worker serves one connection at a
+        # time, and the rest wait in the queue (counted in their TTFB)
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            began = time.perf_counter()
+            list(pool.map(client, [began] * options['clients']))
+        return stats
+
+    # --------------- ASGI ---------------
+
+    async def run_asgi(self, url, cookie, options):
+        application = get_asgi_application()
+        stats = Stats()
+
+        async def client():
+            began = time.perf_counter()
+            finished = asyncio.Event()
+            state = {'requested': False, 'status': 0, 'opened': False}
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': url, 'raw_path': url.encode(),
+                'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            }
+
+            async def receive():
+                if not state['requested']:
+                    state['requested'] = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    state['status'] = message['status']
+                elif message['type'] == 'http.response.body':
+                    if not state['opened']:
+                        stats.stream_opened(began)
+                        state['opened'] = True
+                    if message.get('more_body'):
+                        await asyncio.sleep(options['client_delay'])  # backpressure from the slow client
+
+            try:
+                await application(scope, receive, send)
+            finally:
+                finished.set()
+            stats.stream_closed(began, state['status'])
+
+        await asyncio.gather(*(client() for _ in range(options['clients'])))
+        return stats
+
+    def report(self, name, stats):
+        wall = time.perf_counter() - stats.started
+
+        def p(samples, pct):
+            if len(samples) < 2:
+                return samples[0] if samples else 0
+            return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+        self.stdout.write(
+            f'{name:<8}{wall:>8.2f}{p(stats.first_byte, 50) * 1000:>8.0f}ms{p(stats.first_byte, 95) * 1000:>8.0f}ms'
+            f'{p(stats.finished, 95) * 1000:>8.0f}ms{stats.peak_streams:>9}{stats.peak_threads:>9}{stats.failures:>8}'
+        )
@@ -0,0 +1,107 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from studapp import renditions
+from studapp.models import Note
+from studapp.storage import BLOB_DIR, BLOB_GC_GRACE, blob_name, file_sha256, note_storage
+
+
+class Command(BaseCommand):
+    help = 'Move note files into content-addressed blobs, dropping duplicate copies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without touching files or the database',
+        )
+        parser.add_argument(
+            '--gc',
+            action='store_true',
+            help='Also delete blobs, old media files and renditions that no note references',
+        )
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=BLOB_GC_GRACE,
+            help=f'With --gc, keep files written or reused in the last N seconds (default {BLOB_GC_GRACE})',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = duplicates = saved = 0
+
+        legacy_names = list(
+            Note.objects.exclude(file='').exclude(file__startswith=f'{BLOB_DIR}/')
+            .values_list('file', flat=True).distinct()
+        )
+        for name in legacy_names:
+            path = note_storage.path(name)
+            if not os.path.isfile(path):
+                self.stdout.write(self.style.WARNING(f'  Missing: {name}'))
+                continue
+            with open(path, 'rb') as f:
+                target = blob_name(file_sha256(f), name)
+            size = os.path.getsize(path)
+
+            if dry_run:
+                is_new = not note_storage.exists(target)
+            else:
+                is_new = note_storage.commit_blob(path, target)
+                if not is_new:
+                    os.remove(path)
+                Note.objects.filter(file=name).update(file=target)
+
+            if is_new:
+                moved += 1
+                self.stdout.write(f'  ➡️ {name} → {target}')
+            else:
+                duplicates += 1
+                saved += size
+                self.stdout.write(f'  ♻️ {name} (duplicate of {target})')
+
+        if options['gc']:
+            saved += self.collect_garbage(dry_run, options['grace'])
+
+        if not dry_run:
+            self.prune_empty_dirs(note_storage.path('notes'))
+        prefix = 'Would free' if dry_run else 'Freed'
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✅ {moved} files moved, {duplicates} duplicates removed. {prefix} {saved / (1024 * 1024):.1f} MB.'
+        ))
+
+    def collect_garbage(self, dry_run, grace):
+        """Delete blobs, legacy files and renditions no note references. Returns bytes freed.
+
+        Recently written or reused files are skipped: an upload reusing one may
+        not have committed its note yet.
+        """
+        referenced = set(Note.objects.exclude(file='').values_list('file', flat=True))
+        cutoff = time.time() - grace
+        freed = 0
+        for root in (note_storage.path(BLOB_DIR), note_storage.path('notes')):
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if d != 'incoming']
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, note_storage.location).replace(os.sep, '/')
+                    if name in referenced or os.path.getmtime(path) > cutoff:
+                        continue
+                    freed += os.path.getsize(path)
+                    self.stdout.write(f'  🗑️ Unreferenced: {name}')
+                    if not dry_run:
+                        os.remove(path)
+
+        for identity, path in renditions.orphaned(referenced, cutoff):
+            freed += sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            self.stdout.write(f'  🗑️ Renditions of a deleted file: {identity}')
+            if not dry_run:
+                renditions.release(identity)
+        return freed
+
+    def prune_empty_dirs(self, root):
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
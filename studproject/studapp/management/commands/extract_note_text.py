@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from studapp import extraction, jobs
+from studapp.models import ExtractedText, Note
+
+
+class Command(BaseCommand):
+    help = 'Queue text extraction for note files that have not been extracted yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--now',
+            action='store_true',
+            help='Extract in this process instead of queueing jobs for run_jobs',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-extract files that already have text (implies --now)',
+        )
+
+    def handle(self, *args, **options):
+        notes = Note.objects.exclude(file='').order_by('id')
+        if not options['force']:
+            notes = notes.exclude(file__in=ExtractedText.objects.values('file'))
+
+        done = failed = 0
+        seen = set()
+        for note in notes.iterator():
+            if note.file.name in seen or not extraction.supports(note):
+                continue
+            seen.add(note.file.name)
+            if not (options['now'] or options['force']):
+                jobs.enqueue('extract_text', {'file': note.file.name}, key=extraction.job_key(note))
+                done += 1
+                continue
+            try:
+                extraction.extract(note, force=options['force'])
+            except Exception as exc:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'  ⚠️ {note.title}: {exc}'))
+                continue
+            done += 1
+            self.stdout.write(f'  📝 {note.title}')
+
+        verb = 'extracted' if options['now'] or options['force'] else 'queued'
+        self.stdout.write(self.style.SUCCESS(f'\n✅ {done} files {verb}, {failed} failed.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from studapp import renditions
+from studapp.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Generate preview renditions (image downscales, PDF first pages) for notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-render even if the renditions already exist',
+        )
+
+    def handle(self, *args, **options):
+        written = failed = 0
+        # Renditions are per stored file, however many notes share it
+        for name in Note.objects.exclude(file='').values_list('file', flat=True).distinct().iterator():
+            if not renditions.supports_file(name):
+                continue
+            try:
+                count = renditions.generate(name, force=options['force'])
+            except Exception as exc:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'  ⚠️ {name}: {exc}'))
+                continue
+            if count:
+                written += count
+                self.stdout.write(f'  🖼️ {name} ({count})')
+        self.stdout.write(self.style.SUCCESS(f'\n✅ {written} renditions written, {failed} files failed.'))
@@ -1,4 +1,11 @@
-from django.core.management.base import BaseCommand
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from studapp import navigation, stats
 from studapp.models import Branch, Subject
 
 
@@ -142,6 +149,58 @@ ENGINEERING_DATA = {
 }
 
 
+def load_catalog(path):
+    """Read a JSON or CSV catalog into the ENGINEERING_DATA shape.
+
+    JSON mirrors ENGINEERING_DATA: {branch: {"icon": ..., "subjects": [...]}},
+    where a subject is a name, a [name, icon] pair or an object with
+    name/icon/description. CSV needs `branch` and `subject` columns and may
+    have `icon`, `branch_icon` and `description`.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    catalog = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        if ext == '.json':
+            for branch_name, data in json.load(f).items():
+                subjects = []
+                for entry in data.get('subjects', []):
+                    if isinstance(entry, str):
+                        subjects.append((entry, None))
+                    elif isinstance(entry, dict):
+                        subjects.append((entry['name'], entry.get('icon'), entry.get('description')))
+                    else:
+                        subjects.append(tuple(entry))
+                catalog[branch_name] = {'icon': data.get('icon'), 'subjects': subjects}
+        elif ext == '.csv':
+            reader = csv.DictReader(f)
+            if not {'branch', 'subject'} <= set(reader.fieldnames or ()):
+                raise CommandError(f'{path}: CSV needs "branch" and "subject" columns')
+            for row in reader:
+                branch = catalog.setdefault(row['branch'].strip(), {'icon': None, 'subjects': []})
+                branch['icon'] = (row.get('branch_icon') or '').strip() or branch['icon']
+                branch['subjects'].append((
+                    row['subject'].strip(), (row.get('icon') or '').strip() or None, row.get('description'),
+                ))
+        else:
+            raise CommandError(f'{path}: catalogs must be .json or .csv')
+    return catalog
+
+
+def merge_catalogs(catalogs):
+    """Combine catalogs into {branch: (icon, {subject: (icon, description)})}; later ones win."""
+    merged = {}
+    for catalog in catalogs:
+        for branch_name, data in catalog.items():
+            icon, subjects = merged.get(branch_name, (None, {}))
+            icon = data.get('icon') or icon
+            for entry in data['subjects']:
+                name, subj_icon, description = (tuple(entry) + (None, None))[:3]
+                old_icon, old_description = subjects.get(name, (None, None))
+                subjects[name] = (subj_icon or old_icon, description if description is not None else old_description)
+            merged[branch_name] = (icon, subjects)
+    return merged
+
+
 class Command(BaseCommand):
     help = 'Populate the database with engineering branches and subjects'
 
@@ -151,29 +210,153 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear all existing branches and subjects before populating',
         )
+        parser.add_argument(
+            '--file',
+            action='append',
+            default=[],
+            dest='files',
+            help='Extra JSON or CSV catalog to load (can be repeated)',
+        )
+        parser.add_argument(
+            '--skip-builtin',
+            action='store_true',
+            help='Only load the --file catalogs, not the built-in ENGINEERING_DATA',
+        )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Upsert everything in one transaction with bulk_create and print a diff',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='With --bulk: report the diff without writing anything',
+        )
 
     def handle(self, *args, **options):
-        if options['clear']:
-            self.stdout.write(self.style.WARNING('Clearing all existing branches and subjects...'))
-            Subject.objects.all().delete()
-            Branch.objects.all().delete()
-            self.stdout.write(self.style.SUCCESS('Cleared!\n'))
+        self.verbosity = options['verbosity']
+        catalogs = [] if options['skip_builtin'] else [ENGINEERING_DATA]
+        catalogs += [load_catalog(path) for path in options['files']]
+        catalog = merge_catalogs(catalogs)
+
+        if options['dry_run']:
+            self.bulk_upsert(catalog, dry_run=True)
+            return
 
-        for branch_name, data in ENGINEERING_DATA.items():
+        # The clear shares the write's transaction, so a failed run leaves the old catalog in place
+        with transaction.atomic():
+            if options['clear']:
+                self.stdout.write(self.style.WARNING('Clearing all existing branches and subjects...'))
+                Subject.objects.all().delete()
+                Branch.objects.all().delete()
+                self.stdout.write(self.style.SUCCESS('Cleared!\n'))
+
+            if options['bulk']:
+                self.bulk_upsert(catalog, dry_run=False)
+            else:
+                self.upsert(catalog)
+
+    def upsert(self, catalog):
+        """Create whatever is missing, one row at a time, reporting each."""
+        for branch_name, (icon, subjects) in catalog.items():
             branch, created = Branch.objects.get_or_create(
                 name=branch_name,
-                defaults={'icon': data['icon']}
+                defaults={'icon': icon or '🎓'}
             )
             status = 'Created' if created else 'Exists'
             self.stdout.write(f'  Branch: {branch_name} [{status}]')
 
-            for subj_name, subj_icon in data['subjects']:
+            for subj_name, (subj_icon, description) in subjects.items():
                 subj, created = Subject.objects.get_or_create(
                     name=subj_name,
                     branch=branch,
-                    defaults={'icon': subj_icon}
+                    defaults={'icon': subj_icon or '📘', 'description': description or ''}
                 )
                 s_status = '✅' if created else '⏭️'
                 self.stdout.write(f'    {s_status} {subj_name}')
 
         self.stdout.write(self.style.SUCCESS('\n✅ All branches and subjects populated!'))
+
+    def bulk_upsert(self, catalog, dry_run):
+        """Diff the catalog against the database, then write it in one transaction."""
+        existing_branches = {b.name: b for b in Branch.objects.all()}
+        branches = []  # new or changed only
+        branch_diff = {'created': [], 'updated': [], 'unchanged': []}
+        for name, (icon, _) in catalog.items():
+            current = existing_branches.get(name)
+            icon = icon or (current.icon if current else '🎓')
+            if current is None:
+                branch_diff['created'].append(name)
+            elif current.icon != icon:
+                branch_diff['updated'].append(f'{name}: icon {current.icon} → {icon}')
+            else:
+                branch_diff['unchanged'].append(name)
+                continue
+            branches.append(Branch(name=name, icon=icon))
+
+        existing_subjects = {
+            (s.branch.name, s.name): s
+            for s in Subject.objects.filter(branch__name__in=catalog).select_related('branch')
+        }
+        subject_diff = {'created': [], 'updated': [], 'unchanged': []}
+        pending = []  # new or changed: (branch name, subject name, icon, description)
+        for branch_name, (_, subjects) in catalog.items():
+            for name, (icon, description) in subjects.items():
+                current = existing_subjects.get((branch_name, name))
+                icon = icon or (current.icon if current else '📘')
+                description = description if description is not None else (current.description if current else '')
+                label = f'{branch_name} / {name}'
+                if current is None:
+                    subject_diff['created'].append(label)
+                elif (current.icon, current.description) != (icon, description):
+                    changes = []
+                    if current.icon != icon:
+                        changes.append(f'icon {current.icon} → {icon}')
+                    if current.description != description:
+                        changes.append('description changed')
+                    subject_diff['updated'].append(f'{label}: {", ".join(changes)}')
+                else:
+                    subject_diff['unchanged'].append(label)
+                    continue
+                pending.append((branch_name, name, icon, description))
+
+        if not dry_run and (branches or pending):
+            with transaction.atomic():
+                Branch.objects.bulk_create(
+                    branches, batch_size=500,
+                    update_conflicts=True, unique_fields=['name'], update_fields=['icon'],
+                )
+                branch_ids = dict(Branch.objects.filter(name__in=catalog).values_list('name', 'id'))
+                Subject.objects.bulk_create(
+                    [
+                        Subject(branch_id=branch_ids[b], name=name, icon=icon, description=description)
+                        for b, name, icon, description in pending
+                    ],
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=['branch', 'name'],
+                    update_fields=['icon', 'description'],
+                )
+            # bulk_create sends no signals, so drop the caches the receivers would have
+            transaction.on_commit(navigation.invalidate)
+            transaction.on_commit(stats.invalidate)
+
+        self.report('Branches', branch_diff)
+        self.report('Subjects', subject_diff)
+        verb = 'Would write' if dry_run else 'Wrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✅ {verb} {len(branches)} branches and {len(pending)} subjects in one transaction.'
+        ))
+
+    def report(self, title, diff):
+        self.stdout.write(
+            f'{title}: {len(diff["created"])} created, {len(diff["updated"])} updated, '
+            f'{len(diff["unchanged"])} unchanged'
+        )
+        for name in diff['created']:
+            self.stdout.write(f'  ✅ {name}')
+        for change in diff['updated']:
+            self.stdout.write(f'  ✏️ {change}')
+        if self.verbosity > 1:
+            for name in diff['unchanged']:
+                self.stdout.write(f'  ⏭️ {name}')
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from studapp import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked-upload sessions and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=None,
+            help='Idle time before a session counts as abandoned (default UPLOAD_SESSION_TTL_HOURS)',
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        count = uploads.purge_stale(max_age)
+        self.stdout.write(self.style.SUCCESS(f'✅ {count} stale upload sessions removed.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from studapp import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for notes'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING('Full-text search needs SQLite FTS5; nothing to do.'))
+            return
+        with transaction.atomic():
+            count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'✅ Indexed {count} notes.'))
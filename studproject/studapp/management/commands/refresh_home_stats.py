@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from studapp import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the cached home page statistics'
+
+    def handle(self, *args, **options):
+        snapshot = stats.refresh_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {snapshot['total_notes']} notes across {snapshot['total_branches']} branches."
+        ))
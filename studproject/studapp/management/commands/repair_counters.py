@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from studapp import counters, stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored comment, bookmark and note counters'
+
+    def handle(self, *args, **options):
+        notes, subjects, branches = counters.recount_all()
+        stats.refresh_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Recounted {notes} notes, {subjects} subjects and {branches} branches.'
+        ))
@@ -0,0 +1,165 @@
+import json
+import os
+import statistics
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from studapp.models import Branch, Note, Subject
+from studapp.pagination import encode_cursor
+
+PER_PAGE = 12  # browse_notes page size
+
+
+def build_scenarios():
+    """(name, url, logged_in) for each view under test, pointed at realistic data."""
+    branch = Branch.objects.order_by('-note_count').first()
+    subject = Subject.objects.order_by('-note_count').first()
+    note = Note.objects.exclude(file='').order_by('-downloads').first()
+    total = Note.objects.count()
+
+    scenarios = [
+        ('home', reverse('home'), False),
+        ('browse', reverse('browse'), False),
+        ('browse_search', reverse('browse') + '?q=notes', False),
+        ('browse_search_rare', reverse('browse') + '?q=formula+sheet', False),
+        ('dashboard', reverse('dashboard'), True),
+        ('dashboard_notes', reverse('dashboard_notes'), True),
+        ('dashboard_bookmarks', reverse('dashboard_bookmarks'), True),
+    ]
+    if branch:
+        scenarios.append(('browse_branch', f"{reverse('browse')}?branch={branch.id}", False))
+        scenarios.append(('get_subjects', reverse('get_subjects', args=[branch.id]), False))
+    if subject:
+        scenarios.append(('browse_subject', f"{reverse('browse')}?subject={subject.id}", False))
+    if total > PER_PAGE:
+        deep_page = max(total // PER_PAGE // 2, 1)
+        scenarios.append(('browse_deep_page', f"{reverse('browse')}?page={deep_page}", False))
+        anchor = Note.objects.order_by('-created_at', 'id').values('created_at', 'id')[deep_page * PER_PAGE - 1]
+        cursor = encode_cursor(anchor['created_at'], anchor['id'])
+        scenarios.append(('browse_deep_cursor', f"{reverse('browse')}?after={cursor}", False))
+    if note:
+        scenarios.append(('download_note', reverse('download', args=[note.id]), True))
+    return scenarios
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = 'Time the main views through the test client and compare with a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per view (default 30)')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per view first (default 3)')
+        parser.add_argument('--only', nargs='*', default=None, help='Run just these scenarios')
+        parser.add_argument(
+            '--baseline',
+            default=str(getattr(settings, 'BENCHMARK_BASELINE', settings.BASE_DIR / 'benchmarks' / 'baseline.json')),
+            help='Baseline JSON file to compare against',
+        )
+        parser.add_argument('--save-baseline', action='store_true', help='Write these results as the new baseline')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed p95 slow-down over the baseline before flagging (default 0.25 = 25%%)',
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.annotate(n=Count('notes')).order_by('-n').first()
+        if user is None:
+            raise CommandError('No users found. Run seed_benchmark_data first.')
+
+        setup_test_environment()  # lets the test client talk to 'testserver'
+        try:
+            results = self.run(build_scenarios(), user, options)
+        finally:
+            teardown_test_environment()
+
+        baseline = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        regressions = self.report(results, baseline, options['tolerance'])
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'\n✅ Baseline saved to {options["baseline"]}'))
+        elif regressions:
+            raise CommandError(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+
+    def run(self, scenarios, user, options):
+        anonymous, logged_in = Client(), Client()
+        logged_in.force_login(user)
+        results = {}
+        for name, url, needs_login in scenarios:
+            if options['only'] and name not in options['only']:
+                continue
+            client = logged_in if needs_login else anonymous
+            for _ in range(options['warmup']):
+                self.fetch(client, url)
+            timings, queries = [], []
+            for _ in range(options['iterations']):
+                # Read-only views query through their own alias (see studapp.routers)
+                with ExitStack() as stack:
+                    captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                    start = time.perf_counter()
+                    status = self.fetch(client, url)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(sum(len(context) for context in captured))
+            if status >= 400:
+                self.stdout.write(self.style.WARNING(f'  ⚠️ {name}: HTTP {status}'))
+            results[name] = {
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'queries': max(queries),
+            }
+        return results
+
+    def fetch(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
+        return response.status_code
+
+    def report(self, results, baseline, tolerance):
+        """Print the results table; returns the names of scenarios that regressed."""
+        regressions = []
+        self.stdout.write(f'\n{"scenario":<22}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}  vs baseline')
+        for name, result in results.items():
+            line = (
+                f'{name:<22}{result["p50_ms"]:>10.1f}{result["p95_ms"]:>10.1f}'
+                f'{result["p99_ms"]:>10.1f}{result["queries"]:>9}  '
+            )
+            base = baseline.get(name)
+            if base is None:
+                self.stdout.write(line + '—')
+                continue
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0
+            # Tiny absolute differences are noise, whatever the percentage
+            slower = change > tolerance and result['p95_ms'] - base['p95_ms'] > 1
+            more_queries = result['queries'] > base['queries']
+            note = f'p95 {change:+.0%}, queries {base["queries"]}→{result["queries"]}'
+            if slower or more_queries:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '❌ ' + note))
+            else:
+                self.stdout.write(line + '✅ ' + note)
+        return regressions
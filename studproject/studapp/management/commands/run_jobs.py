@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from studapp import jobs
+
+logger = logging.getLogger('studapp.jobs')
+
+
+def work(stop, worker_id, once, poll_interval):
+    """Claim and run jobs until `stop` is set (or, with `once`, the queue is empty)."""
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = jobs.claim(worker_id)
+            except OperationalError as exc:
+                # Another worker holds the write lock; try again shortly
+                logger.warning('%s could not claim a job: %s', worker_id, exc)
+                stop.wait(poll_interval)
+                continue
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+            jobs.run_job(job)
+    finally:
+        connection.close()
+
+
+def serve(stop, threads, once, poll_interval):
+    """Run `threads` workers in this process and wait for them."""
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    workers = [
+        threading.Thread(target=work, args=(stop, f'{prefix}:{i}', once, poll_interval), daemon=True)
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (thumbnails, text extraction) from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to fork (default 1)')
+        parser.add_argument('--threads', type=int, default=2, help='Worker threads per process (default 2)')
+        parser.add_argument('--once', action='store_true', help='Exit when no jobs are due instead of polling')
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when the queue is empty (default 2)',
+        )
+
+    def handle(self, *args, **options):
+        processes = max(options['processes'], 1)
+        threads = max(options['threads'], 1)
+        once, poll_interval = options['once'], options['poll_interval']
+
+        if processes > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            self.stdout.write(self.style.WARNING('fork is not available here; running one process instead.'))
+            processes = 1
+        context = multiprocessing.get_context('fork') if processes > 1 else None
+        stop = context.Event() if context else threading.Event()
+
+        def request_stop(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f'Running jobs with {processes} process(es) × {threads} thread(s) (Ctrl+C to stop)')
+        if context is None:
+            serve(stop, threads, once, poll_interval)
+        else:
+            # Children must open their own database connections
+            connections.close_all()
+            children = [
+                context.Process(target=serve, args=(stop, threads, once, poll_interval))
+                for _ in range(processes)
+            ]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join()
+        self.stdout.write(self.style.SUCCESS('✅ Job worker stopped.'))
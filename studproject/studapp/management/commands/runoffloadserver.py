@@ -0,0 +1,22 @@
+from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import run
+from django.core.wsgi import get_wsgi_application
+
+from studapp.delivery import delivery_mode
+from studapp.offload import OffloadStandIn
+
+
+class Command(BaseCommand):
+    help = 'Run a local server that handles X-Accel-Redirect / X-Sendfile like the front end would'
+
+    def add_arguments(self, parser):
+        parser.add_argument('addrport', nargs='?', default='127.0.0.1:8000', help='host:port to listen on')
+
+    def handle(self, *args, **options):
+        host, _, port = options['addrport'].rpartition(':')
+        if not delivery_mode():  # also rejects an unknown mode up front
+            self.stdout.write(self.style.WARNING('FILE_DELIVERY_MODE is off; files will stream through Django.'))
+        application = OffloadStandIn(StaticFilesHandler(get_wsgi_application()))
+        self.stdout.write(f'Serving on http://{host or "127.0.0.1"}:{port}/ (Ctrl+C to stop)')
+        run(host or '127.0.0.1', int(port), application, threading=True)
@@ -0,0 +1,186 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from studapp import counters, navigation, search, stats
+from studapp.management.commands.populate_subjects import ENGINEERING_DATA
+from studapp.models import Bookmark, Branch, Comment, Note, Subject
+from studapp.storage import blob_name, file_sha256, note_storage
+
+USERNAME_PREFIX = 'bench_'
+TOPICS = (
+    'Unit 1 notes', 'Unit 2 notes', 'Unit 3 notes', 'Question bank', 'Previous year papers',
+    'Lab manual', 'Assignment solutions', 'Quick revision', 'Formula sheet', 'Mind map',
+)
+COMMENTS = ('Very helpful, thanks!', 'Great notes.', 'Page 3 has a typo.', 'Exactly what I needed for the exam.')
+SKEW = 3.0  # higher = more of the activity lands on the most popular items
+
+
+def skewed_index(rng, n):
+    """Index in [0, n) with a long-tail (power-law) bias towards 0."""
+    return min(int(n * rng.random() ** SKEW), n - 1)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the created_at/updated_at values we set."""
+    fields = [
+        f for model in models for f in model._meta.fields
+        if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)
+    ]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Seed a large synthetic dataset for benchmarks (use a throwaway database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Users to create (default 500)')
+        parser.add_argument('--notes', type=int, default=100_000, help='Notes to create (default 100,000)')
+        parser.add_argument('--comments', type=int, default=200_000, help='Comments to create (default 200,000)')
+        parser.add_argument('--bookmarks', type=int, default=100_000, help='Bookmarks to aim for (default 100,000)')
+        parser.add_argument('--days', type=int, default=730, help='Spread creation dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create (default 5000)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for repeatable datasets')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.span = options['days'] * 86400
+        started = time.monotonic()
+
+        subjects = self.seed_subjects(rng)
+        users = self.seed_users(options['users'])
+        files = self.seed_files()
+        note_ids = self.seed_notes(rng, options['notes'], users, subjects, files)
+        rng.shuffle(note_ids)  # popularity shouldn't follow upload order
+        self.seed_comments(rng, options['comments'], users, note_ids)
+        self.seed_bookmarks(rng, options['bookmarks'], users, note_ids)
+
+        # bulk_create skips signals: bring counters, the search index and caches up to date
+        self.stdout.write('Recounting and reindexing...')
+        counters.recount_all()
+        search.rebuild_index()
+        navigation.invalidate()
+        stats.refresh_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Seeded in {time.monotonic() - started:.0f}s.'))
+
+    def random_time(self, rng):
+        return self.now - timedelta(seconds=rng.uniform(0, self.span))
+
+    def seed_subjects(self, rng):
+        for branch_name, data in ENGINEERING_DATA.items():
+            branch, _ = Branch.objects.get_or_create(name=branch_name, defaults={'icon': data['icon']})
+            for subj_name, subj_icon in data['subjects']:
+                Subject.objects.get_or_create(name=subj_name, branch=branch, defaults={'icon': subj_icon})
+        subjects = list(Subject.objects.values_list('id', flat=True))
+        rng.shuffle(subjects)
+        self.stdout.write(f'  📘 {len(subjects)} subjects')
+        return subjects
+
+    def seed_users(self, count):
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        password = make_password('benchmark')
+        users = [
+            User(
+                username=f'{USERNAME_PREFIX}{i}', first_name=f'Student{i}',
+                email=f'{USERNAME_PREFIX}{i}@example.com', password=password,
+            )
+            for i in range(start, start + count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('id', flat=True))
+        self.stdout.write(f'  👤 {count} users created ({len(ids)} benchmark users in total)')
+        return ids
+
+    def seed_files(self):
+        """A few shared blobs of different sizes; every seeded note points at one."""
+        names = []
+        for size in (4 * 1024, 64 * 1024, 512 * 1024):
+            line = b'Synthetic benchmark note: data structures, algorithms and operating systems.\n'
+            content = (line * (size // len(line) + 1))[:size]
+            digest = file_sha256(BytesIO(content))
+            name = blob_name(digest, f'seed-{size}.txt')
+            if not note_storage.exists(name):
+                note_storage.save(name, BytesIO(content))
+            names.append(name)
+        return names
+
+    def seed_notes(self, rng, count, users, subjects, files):
+        ids = []
+        for offset in range(0, count, self.batch_size):
+            batch = []
+            for i in range(offset, min(offset + self.batch_size, count)):
+                created = self.random_time(rng)
+                subject = subjects[skewed_index(rng, len(subjects))]
+                batch.append(Note(
+                    title=f'{rng.choice(TOPICS)} #{i}',
+                    description='Synthetic note for benchmarks. Covers key definitions, derivations and examples.',
+                    subject_id=subject,
+                    uploaded_by_id=users[skewed_index(rng, len(users))],
+                    file=files[skewed_index(rng, len(files))],
+                    original_filename=f'note-{i}.txt',
+                    created_at=created,
+                    updated_at=created,
+                    downloads=int(1000 * rng.random() ** 6),
+                ))
+            with explicit_timestamps(Note), transaction.atomic():
+                ids.extend(note.id for note in Note.objects.bulk_create(batch))
+            self.stdout.write(f'  📄 {len(ids)}/{count} notes', ending='\r')
+        self.stdout.write('')
+        return ids
+
+    def seed_comments(self, rng, count, users, note_ids):
+        if not note_ids:
+            return
+        created_total = 0
+        for offset in range(0, count, self.batch_size):
+            batch = [
+                Comment(
+                    note_id=note_ids[skewed_index(rng, len(note_ids))],
+                    user_id=rng.choice(users),
+                    text=rng.choice(COMMENTS),
+                    created_at=self.random_time(rng),
+                )
+                for _ in range(min(self.batch_size, count - offset))
+            ]
+            with explicit_timestamps(Comment), transaction.atomic():
+                Comment.objects.bulk_create(batch)
+            created_total += len(batch)
+            self.stdout.write(f'  💬 {created_total}/{count} comments', ending='\r')
+        self.stdout.write('')
+
+    def seed_bookmarks(self, rng, count, users, note_ids):
+        if not note_ids:
+            return
+        pairs = set()
+        # Repeated (user, note) picks are dropped, so the most popular notes saturate
+        for _ in range(count * 10):
+            if len(pairs) >= count:
+                break
+            pairs.add((users[skewed_index(rng, len(users))], note_ids[skewed_index(rng, len(note_ids))]))
+        pairs = list(pairs)
+        for offset in range(0, len(pairs), self.batch_size):
+            batch = [
+                Bookmark(user_id=user, note_id=note, created_at=self.random_time(rng))
+                for user, note in pairs[offset:offset + self.batch_size]
+            ]
+            with explicit_timestamps(Bookmark), transaction.atomic():
+                Bookmark.objects.bulk_create(batch, ignore_conflicts=True)
+        self.stdout.write(f'  🔖 {len(pairs)} bookmarks')
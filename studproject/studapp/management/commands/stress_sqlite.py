@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.test.utils import override_settings
+
+from studapp.dbprofile import get_profile, is_busy_error, set_journal_mode
+from studapp.models import Branch, Note, Subject
+from studapp.routers import read_alias, read_only_view
+
+SUBJECTS = 50
+# Keep signal-driven cache invalidations away from the site's real cache
+SCRATCH_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def use_database(path, profiled, options):
+    """Point the default and read-only aliases at the scratch database `path`.
+
+    Stock is what Django gives you out of the box: no pragmas, deferred
+    transactions, every read on the default alias. Profiled keeps this
+    project's `options` (transaction_mode), DATABASE_PROFILE pragmas and
+    retry_on_busy, and routes reads as `read_only_view` does; the caller
+    switches its copy to WAL, as migrate does for the real database.
+    """
+    connections.close_all()
+    default = connections[DEFAULT_DB_ALIAS].settings_dict
+    default['NAME'] = path
+    default['OPTIONS'] = {
+        name: value for name, value in options.items() if profiled or name != 'transaction_mode'
+    }
+    if read_alias():
+        connections[read_alias()].settings_dict['NAME'] = f'file:{path}?mode=ro'
+
+
+def upload(subject_id, user_id):
+    """One upload, as the upload views do it; the counters follow via signals."""
+    with transaction.atomic():
+        subject = Subject.objects.get(id=subject_id)
+        Note.objects.create(title='Stress test note', subject=subject, uploaded_by_id=user_id)
+
+
+def browse(request=None):
+    list(Note.objects.order_by('-created_at').values_list('id', 'title')[:12])
+    Note.objects.count()
+
+
+# The same reads, sent to the read-only alias by the router (browse stands in for a view)
+routed_browse = read_only_view(browse)
+
+
+def worker(role, profiled, seconds, results):
+    # Forked with the parent's settings; each process opens its own connections
+    user_id = User.objects.values_list('id', flat=True).first()
+    subject_ids = list(Subject.objects.values_list('id', flat=True))
+    done = errors = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    n = os.getpid()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if role == 'writer':
+                n += 1
+                upload(subject_ids[n % len(subject_ids)], user_id)
+            elif profiled:
+                routed_browse(None)
+            else:
+                browse()
+            done += 1
+            latencies.append(time.perf_counter() - start)
+        except OperationalError as exc:
+            if not is_busy_error(exc):
+                raise
+            errors += 1
+    connections.close_all()
+    results.put((role, done, errors, latencies))
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer a scratch copy of the schema with concurrent writers and readers through the ORM, '
+        'stock Django vs this project\'s database settings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Writer processes (default 4)')
+        parser.add_argument('--readers', type=int, default=4, help='Reader processes (default 4)')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run (default 5)')
+
+    def handle(self, *args, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('Needs the fork start method: the workers inherit the scratch database settings.')
+        aliases = [DEFAULT_DB_ALIAS] + ([read_alias()] if read_alias() else [])
+        saved = {alias: dict(connections[alias].settings_dict) for alias in aliases}
+        transaction_mode = saved[DEFAULT_DB_ALIAS]['OPTIONS'].get('transaction_mode', 'DEFERRED')
+        self.stdout.write(f'Profile: {get_profile()}, transaction_mode: {transaction_mode}\n')
+        self.stdout.write(f'{"mode":<10}{"writes/s":>10}{"reads/s":>10}{"locked":>8}{"write p95 ms":>14}{"read p95 ms":>13}')
+        try:
+            with tempfile.TemporaryDirectory() as tmp, override_settings(CACHES=SCRATCH_CACHES):
+                template = os.path.join(tmp, 'template.sqlite3')
+                self.create_template(template)
+                for profiled in (False, True):
+                    mode = 'profiled' if profiled else 'stock'
+                    path = os.path.join(tmp, f'{mode}.sqlite3')
+                    shutil.copy(template, path)
+                    use_database(path, profiled, saved[DEFAULT_DB_ALIAS]['OPTIONS'])
+                    if profiled:
+                        set_journal_mode(connections[DEFAULT_DB_ALIAS])
+                        connections.close_all()
+                    self.report(mode, self.run(profiled, options), options['seconds'])
+        finally:
+            connections.close_all()
+            for alias, settings_dict in saved.items():
+                connections[alias].settings_dict.clear()
+                connections[alias].settings_dict.update(settings_dict)
+
+    def create_template(self, path):
+        """Migrate a scratch database and add a user and SUBJECTS subjects to upload into."""
+        use_database(path, False, {})
+        with override_settings(DATABASE_PROFILE_ENABLED=False):  # migrate leaves it in the default journal mode
+            call_command('migrate', verbosity=0, interactive=False)
+            User.objects.create_user('stress', password=None)
+            branch = Branch.objects.create(name='Stress', icon='🔥')
+            Subject.objects.bulk_create(
+                [Subject(name=f'Subject {i}', branch=branch) for i in range(1, SUBJECTS + 1)]
+            )
+        connections.close_all()
+
+    def run(self, profiled, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        roles = ['writer'] * options['writers'] + ['reader'] * options['readers']
+        with override_settings(DATABASE_PROFILE_ENABLED=profiled):
+            processes = [
+                context.Process(target=worker, args=(role, profiled, options['seconds'], results))
+                for role in roles
+            ]
+            for process in processes:
+                process.start()
+            collected = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+        return collected
+
+    def report(self, mode, collected, seconds):
+        def summary(role):
+            rows = [row for row in collected if row[0] == role]
+            latencies = sorted(latency for row in rows for latency in row[3])
+            p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else 0
+            return sum(row[1] for row in rows) / seconds, sum(row[2] for row in rows), p95
+
+        writes, write_errors, write_p95 = summary('writer')
+        reads, read_errors, read_p95 = summary('reader')
+        self.stdout.write(
+            f'{mode:<10}{writes:>10.0f}{reads:>10.0f}{write_errors + read_errors:>8}'
+            f'{write_p95:>14.1f}{read_p95:>13.1f}'
+        )
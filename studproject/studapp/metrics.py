@@ -0,0 +1,331 @@
+"""Per-request performance metrics: SQL, template rendering, streamed bytes, latency.
+
+`RequestMetricsMiddleware` (studapp.middleware) opens a `RequestStats` for
+each request. SQL is timed by an execute wrapper on every connection,
+templates by the `TimedDjangoTemplates` backend, and streamed bodies by
+wrapping their iterator. The results go to staff in a `Server-Timing` header and into
+histograms, labelled by URL name, served at `/metrics` in the Prometheus
+text format.
+
+Each process keeps its histograms in memory and writes them every
+METRICS_FLUSH_INTERVAL seconds to its own file in METRICS_DIR. `/metrics`
+adds up every process's file, so the numbers cover all workers. Files left
+by processes that have exited are folded into `merged.json` at scrape
+time, so the directory doesn't grow with every worker restart and the
+totals never go backwards. That needs POSIX (process checks and `flock`)
+and a METRICS_DIR that only this host's processes write to.
+"""
+import atexit
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: dead processes' files stay where they are
+    fcntl = None
+
+# name -> (type, help, bucket upper bounds or None for counters)
+METRICS = {
+    'studapp_request_duration_seconds': (
+        'histogram', 'Time until the response is ready (before any streamed body).',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'studapp_request_sql_seconds': (
+        'histogram', 'Time spent in SQL per request.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'studapp_request_sql_queries': (
+        'histogram', 'SQL queries per request.',
+        (0, 1, 2, 5, 10, 20, 50, 100, 200),
+    ),
+    'studapp_request_template_seconds': (
+        'histogram', 'Time spent rendering templates per request.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    ),
+    'studapp_streamed_bytes_total': (
+        'counter', 'Bytes sent in streamed response bodies (file downloads, previews).', None,
+    ),
+}
+
+_current = contextvars.ContextVar('studapp_request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_queries += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """`Server-Timing` header value; durations in milliseconds."""
+        app = max(total - self.sql_time - self.template_time, 0)
+        return ', '.join([
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f};desc="templates"',
+            f'app;dur={app * 1000:.1f};desc="view code"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    """The RequestStats of the request being handled, or None."""
+    return _current.get()
+
+
+def sql_timer(execute, sql, params, many, context):
+    """Execute wrapper: charge the query to the current request, if there is one."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.sql_wrapper(execute, sql, params, many, context)
+
+
+def install_sql_timer(sender, connection, **kwargs):
+    """`connection_created` receiver.
+
+    Installed on each connection rather than around the request, because
+    async views run their queries on a worker thread's connection. The
+    request's context (and so its RequestStats) goes with them.
+    """
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+# --------------- Template timing ---------------
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The standard Django template backend, timing each top-level render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        # origin, backend etc. come from the wrapped template
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+# --------------- Aggregation ---------------
+
+class Registry:
+    """This process's histograms and counters, flushed to a per-process file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_flush = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        # (metric, view) -> [bucket counts..., sum, count] for histograms, [total] for counters
+        self.samples = {}
+        # Start time in the file name, so a recycled PID never overwrites a dead process's file
+        self.filename = f'{os.getpid()}-{time.time_ns()}.json'
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # Samples copied from the parent belong to the parent's file
+            self._pid = os.getpid()
+            self._reset()
+
+    def observe(self, name, view, value):
+        kind, _, buckets = METRICS[name]
+        with self._lock:
+            self._check_fork()
+            key = (name, view)
+            if kind == 'counter':
+                self.samples.setdefault(key, [0])[0] += value
+            else:
+                sample = self.samples.setdefault(key, [0] * (len(buckets) + 2))
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        sample[i] += 1
+                sample[-2] += value
+                sample[-1] += 1
+        self.maybe_flush()
+
+    def record_request(self, view, stats, total):
+        self.observe('studapp_request_duration_seconds', view, total)
+        self.observe('studapp_request_sql_seconds', view, stats.sql_time)
+        self.observe('studapp_request_sql_queries', view, stats.sql_queries)
+        self.observe('studapp_request_template_seconds', view, stats.template_time)
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's samples to its file in METRICS_DIR."""
+        directory = metrics_dir()
+        with self._lock:
+            self._check_fork()
+            self._last_flush = time.monotonic()
+            if not self.samples:
+                return
+            data = [[name, view, list(values)] for (name, view), values in self.samples.items()]
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(directory, self.filename))
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def metrics_dir():
+    return str(getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'studapp-metrics')))
+
+
+MERGED_FILE = 'merged.json'
+PROCESS_FILE = re.compile(r'^(\d+)-\d+\.json$')
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []  # a file being replaced mid-read; next scrape gets it
+
+
+def _add(totals, data):
+    for name, view, values in data:
+        if name not in METRICS:
+            continue
+        total = totals[(name, view)]
+        if not total:
+            total.extend([0] * len(values))
+        for i, value in enumerate(values):
+            total[i] += value
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # someone else's process
+    return True
+
+
+def _merge_dead(directory):
+    """Fold the files of exited processes into MERGED_FILE and delete them. Call with the lock held."""
+    dead = [
+        filename for filename in os.listdir(directory)
+        if (match := PROCESS_FILE.match(filename))
+        and int(match[1]) != os.getpid() and not _process_alive(int(match[1]))
+    ]
+    if not dead:
+        return
+    totals = defaultdict(list)
+    for filename in [MERGED_FILE, *dead]:
+        _add(totals, _read(os.path.join(directory, filename)))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump([[name, view, values] for (name, view), values in totals.items()], f)
+    os.replace(tmp_path, os.path.join(directory, MERGED_FILE))
+    for filename in dead:
+        os.remove(os.path.join(directory, filename))
+
+
+def _sum_files(directory):
+    totals = defaultdict(list)
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            _add(totals, _read(os.path.join(directory, filename)))
+    return totals
+
+
+def collect():
+    """Samples summed over every process's file: {(metric, view): values}."""
+    directory = metrics_dir()
+    if not os.path.isdir(directory):
+        return defaultdict(list)
+    if fcntl is None:
+        return _sum_files(directory)
+    # Held while reading too, so a file being merged is never counted twice
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _merge_dead(directory)
+        return _sum_files(directory)
+
+
+def _labels(view, **extra):
+    labels = {'view': view, **extra}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def render_prometheus():
+    """All metrics, across processes, in the Prometheus text exposition format."""
+    registry.flush()
+    totals = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, view), values in sorted(totals.items()):
+            if metric != name:
+                continue
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(view)} {values[0]}')
+                continue
+            for bound, count in zip(buckets, values):
+                lines.append(f'{name}_bucket{_labels(view, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_labels(view, le="+Inf")} {values[-1]}')
+            lines.append(f'{name}_sum{_labels(view)} {values[-2]}')
+            lines.append(f'{name}_count{_labels(view)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,80 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """Time SQL, templates and the whole request; see studapp.metrics.
+
+    Goes first in MIDDLEWARE so the timing covers the other middleware too.
+    Works under WSGI and ASGI; in the async chain it never blocks the loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats)
+
+    @staticmethod
+    def loaded_user(request):
+        """The user, if the view or another middleware already loaded it; else None.
+
+        Only staff get Server-Timing, but looking the user up just to decide
+        would cost a session and a user query on requests that never needed
+        them. These are where AuthenticationMiddleware caches the user.
+        """
+        return getattr(request, '_cached_user', None) or getattr(request, '_acached_user', None)
+
+    def finish(self, request, response, stats):
+        total = stats.elapsed()
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        metrics.registry.record_request(view, stats, total)
+
+        user = self.loaded_user(request)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = stats.server_timing(total)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.acount_bytes(response.streaming_content, view)
+            else:
+                response.streaming_content = self.count_bytes(response.streaming_content, view)
+        return response
+
+    def count_bytes(self, content, view):
+        sent = 0
+        try:
+            for chunk in content:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.registry.observe('studapp_streamed_bytes_total', view, sent)
+
+    async def acount_bytes(self, content, view):
+        sent = 0
+        try:
+            async for chunk in content:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.registry.observe('studapp_streamed_bytes_total', view, sent)
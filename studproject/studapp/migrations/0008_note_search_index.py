@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS studapp_note_fts USING fts5("
+        "title, description, subject, branch, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO studapp_note_fts (rowid, title, description, subject, branch) "
+        "SELECT n.id, n.title, n.description, s.name, COALESCE(b.name, '') "
+        "FROM studapp_note n "
+        "INNER JOIN studapp_subject s ON s.id = n.subject_id "
+        "LEFT JOIN studapp_branch b ON b.id = s.branch_id"
+    )
+    schema_editor.execute(
+        "INSERT INTO studapp_note_fts (studapp_note_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0, 3.0)')"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS studapp_note_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0007_comment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:11
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(n=Count('pk')).values('n')
+    ), Value(0))
+
+
+def backfill_counters(apps, schema_editor):
+    Note = apps.get_model('studapp', 'Note')
+    Subject = apps.get_model('studapp', 'Subject')
+    Branch = apps.get_model('studapp', 'Branch')
+    Comment = apps.get_model('studapp', 'Comment')
+    Bookmark = apps.get_model('studapp', 'Bookmark')
+    Note.objects.update(comment_count=count_of(Comment, 'note'), bookmark_count=count_of(Bookmark, 'note'))
+    Subject.objects.update(note_count=count_of(Note, 'subject'))
+    Branch.objects.update(note_count=count_of(Note, 'subject__branch'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0008_note_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='note_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='note_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
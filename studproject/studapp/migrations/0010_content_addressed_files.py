@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:12
+
+import studapp.storage
+from django.db import migrations, models
+
+
+def fill_original_filenames(apps, schema_editor):
+    Note = apps.get_model('studapp', 'Note')
+    for note in Note.objects.filter(original_filename='').exclude(file=''):
+        note.original_filename = note.file.name.split('/')[-1]
+        note.save(update_fields=['original_filename'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0009_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='original_filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='file',
+            field=models.FileField(storage=studapp.storage.get_note_storage, upload_to='blobs/'),
+        ),
+        migrations.RunPython(fill_original_filenames, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:20
+
+import studapp.storage
+from django.db import migrations, models
+
+
+def create_page_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # One row per page of extracted text; filled by the extract_text job
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS studapp_page_fts USING fts5("
+        "body, file UNINDEXED, page UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def drop_page_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS studapp_page_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0012_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(max_length=255, unique=True)),
+                ('text', models.TextField(blank=True, default='')),
+                ('page_offsets', models.JSONField(default=list)),
+                ('extracted_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='file',
+            field=models.FileField(db_index=True, storage=studapp.storage.get_note_storage, upload_to='blobs/'),
+        ),
+        migrations.RunPython(create_page_index, drop_page_index),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:34
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def merge_duplicate_subjects(apps, schema_editor):
+    # Fold any repeated (branch, name) subjects into the oldest one so the constraint can apply
+    Subject = apps.get_model('studapp', 'Subject')
+    Note = apps.get_model('studapp', 'Note')
+    duplicates = (
+        Subject.objects.values('branch_id', 'name')
+        .annotate(keep=Min('id'), n=models.Count('id')).filter(n__gt=1)
+    )
+    for dup in duplicates:
+        extras = Subject.objects.filter(branch_id=dup['branch_id'], name=dup['name']).exclude(id=dup['keep'])
+        moved = sum(extras.values_list('note_count', flat=True))
+        Note.objects.filter(subject__in=extras).update(subject_id=dup['keep'])
+        Subject.objects.filter(id=dup['keep']).update(note_count=models.F('note_count') + moved)
+        extras.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0013_extracted_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_subjects, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subject',
+            constraint=models.UniqueConstraint(fields=('branch', 'name'), name='unique_subject_per_branch'),
+        ),
+    ]
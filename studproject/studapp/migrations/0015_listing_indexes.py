@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0014_unique_subject_per_branch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', '-created_at'], name='studapp_boo_user_id_decfb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['note', '-created_at', 'id'], name='studapp_com_note_id_9c576a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-created_at', 'id'], name='studapp_not_created_8b7c23_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['subject', '-created_at', 'id'], name='studapp_not_subject_e6469a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['uploaded_by', '-created_at'], name='studapp_not_uploade_d82eb3_idx'),
+        ),
+    ]
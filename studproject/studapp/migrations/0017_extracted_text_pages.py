@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+def count_pages(apps, schema_editor):
+    # The text itself is already in studapp_page_fts; only the page count is kept
+    ExtractedText = apps.get_model('studapp', 'ExtractedText')
+    for extracted in ExtractedText.objects.only('id', 'page_offsets').iterator():
+        ExtractedText.objects.filter(id=extracted.id).update(pages=len(extracted.page_offsets))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studapp', '0016_upload_chunk_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractedtext',
+            name='pages',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_pages, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='extractedtext',
+            name='page_offsets',
+        ),
+        migrations.RemoveField(
+            model_name='extractedtext',
+            name='text',
+        ),
+    ]
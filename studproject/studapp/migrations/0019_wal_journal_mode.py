@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:05
+
+from django.conf import settings
+from django.db import migrations
+
+import studapp.dbprofile
+
+
+def enable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite' or not getattr(settings, 'DATABASE_PROFILE_ENABLED', True):
+        return
+    studapp.dbprofile.set_journal_mode(schema_editor.connection)
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    studapp.dbprofile.set_journal_mode(schema_editor.connection, 'delete')
+
+
+class Migration(migrations.Migration):
+    # SQLite can't change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('studapp', '0018_upload_session_note'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
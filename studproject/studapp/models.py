@@ -1,12 +1,17 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
+from .storage import get_note_storage
+
 
 class Branch(models.Model):
     """Engineering branch (CSE, ECE, etc.)."""
     name = models.CharField(max_length=150, unique=True)
     icon = models.CharField(max_length=50, default='🎓')
     created_at = models.DateTimeField(auto_now_add=True)
+    note_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -23,12 +28,17 @@ class Subject(models.Model):
     icon = models.CharField(max_length=50, default='📘')
     description = models.TextField(blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
+    note_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.name} ({self.branch.name})" if self.branch else self.name
 
     class Meta:
         ordering = ['branch__name', 'name']
+        constraints = [
+            # Lets catalog imports upsert on (branch, name); see populate_subjects --bulk
+            models.UniqueConstraint(fields=['branch', 'name'], name='unique_subject_per_branch'),
+        ]
 
 
 class Note(models.Model):
@@ -37,16 +47,31 @@ class Note(models.Model):
     description = models.TextField(blank=True, default='')
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='notes')
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes')
-    file = models.FileField(upload_to='notes/%Y/%m/%d/')
+    # Stored content-addressed (see studapp.storage); the name shown on download is kept separately
+    file = models.FileField(upload_to='blobs/', storage=get_note_storage, db_index=True)
+    original_filename = models.CharField(max_length=255, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     downloads = models.PositiveIntegerField(default=0)
+    # Denormalized counters, kept in step by signal receivers (see studapp.counters)
+    comment_count = models.PositiveIntegerField(default=0)
+    bookmark_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.title} — {self.subject.name}"
 
+    @property
+    def download_name(self):
+        return self.original_filename or self.file.name.split('/')[-1]
+
     class Meta:
         ordering = ['-created_at']
+        # Each matches a listing's filter + ORDER BY, so pages come straight off the index
+        indexes = [
+            models.Index(fields=['-created_at', 'id']),                # browse (keyset and numbered pages)
+            models.Index(fields=['subject', '-created_at', 'id']),     # browse by subject
+            models.Index(fields=['uploaded_by', '-created_at']),       # dashboard: my uploads
+        ]
 
 
 class Bookmark(models.Model):
@@ -57,6 +82,7 @@ class Bookmark(models.Model):
 
     class Meta:
         unique_together = ('user', 'note')
+        indexes = [models.Index(fields=['user', '-created_at'])]  # dashboard: my bookmarks, newest first
 
     def __str__(self):
         return f"{self.user.username} → {self.note.title}"
@@ -71,6 +97,72 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['note', '-created_at', 'id'])]  # note_comments pages
 
     def __str__(self):
         return f"{self.user.username}: {self.text[:40]}"
+
+
+class Job(models.Model):
+    """A unit of background work, run by the `run_jobs` worker."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=100)
+    key = models.CharField(max_length=255, unique=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.task} [{self.status}]"
+
+
+class UploadSession(models.Model):
+    """A chunked upload in progress; becomes a Note when finalized (see studapp.uploads)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True, default='')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='+')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # Bytes acknowledged so far; the next chunk must start here
+    received = models.PositiveBigIntegerField(default=0)
+    # Set while a PUT is writing a chunk (or a POST finishing), so only one request touches the part file
+    writing_since = models.DateTimeField(null=True, blank=True)
+    # The note it became; a repeated finish returns this instead of a second note
+    note = models.ForeignKey(Note, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+
+class ExtractedText(models.Model):
+    """Marks a stored file whose text has been extracted (see studapp.extraction).
+
+    The text itself lives only in the page index (`studapp_page_fts`), which
+    is what search and snippets read.
+    """
+    file = models.CharField(max_length=255, unique=True)  # storage name, i.e. the content identity
+    pages = models.PositiveIntegerField(default=0)
+    extracted_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.file} ({self.pages} pages)"
@@ -0,0 +1,41 @@
+"""Cached branch → subject tree used for navigation in every template."""
+import time
+
+from django.core.cache import cache
+
+from .models import Branch, Subject
+
+VERSION_KEY = 'nav-tree:version'
+TREE_TIMEOUT = 24 * 60 * 60  # stale versions simply age out
+
+
+def _tree_key(version):
+    return f'nav-tree:{version}'
+
+
+def build_tree():
+    """Two queries, no model instances: [{id, name, icon, subjects: [{id, name, icon}]}]."""
+    tree = [dict(branch, subjects=[]) for branch in Branch.objects.values('id', 'name', 'icon')]
+    by_id = {branch['id']: branch for branch in tree}
+    for subject in Subject.objects.filter(branch__isnull=False).order_by('name').values('id', 'name', 'icon', 'branch_id'):
+        by_id[subject.pop('branch_id')]['subjects'].append(subject)
+    return tree
+
+
+def get_tree():
+    """Return the navigation tree, building it only when the version has moved on."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = invalidate()
+    tree = cache.get(_tree_key(version))
+    if tree is None:
+        tree = build_tree()
+        cache.set(_tree_key(version), tree, TREE_TIMEOUT)
+    return tree
+
+
+def invalidate():
+    """Bump the version so every process rebuilds the tree on its next read."""
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, None)
+    return version
@@ -0,0 +1,90 @@
+"""Pure-Python stand-in for the front-end server's internal redirects.
+
+Wraps the Django WSGI app and does what nginx/Apache would do with an
+`X-Accel-Redirect` or `X-Sendfile` response: drop the (empty) body and
+send the named file instead, honouring a single byte range. Meant for
+tests and local runs of FILE_DELIVERY_MODE, not for production.
+"""
+import os
+from urllib.parse import unquote
+
+from django.conf import settings
+
+from .delivery import CHUNK_SIZE, parse_range_header
+
+# Headers from the Django response that the front end passes through
+PASSTHROUGH_HEADERS = {
+    'content-type', 'content-disposition', 'etag', 'last-modified',
+    'cache-control', 'set-cookie', 'vary',
+}
+
+
+class OffloadStandIn:
+    """WSGI middleware that serves internal-redirect responses itself."""
+
+    def __init__(self, application):
+        self.application = application
+
+    def resolve(self, headers):
+        """Filesystem path named by an internal-redirect header, or None."""
+        if 'x-sendfile' in headers:
+            return headers['x-sendfile']
+        if 'x-accel-redirect' in headers:
+            prefix = getattr(settings, 'FILE_DELIVERY_INTERNAL_PREFIX', '/protected-media/').rstrip('/') + '/'
+            uri = unquote(headers['x-accel-redirect'])
+            if not uri.startswith(prefix):
+                return None
+            root = os.path.realpath(settings.MEDIA_ROOT)
+            path = os.path.realpath(os.path.join(root, uri[len(prefix):]))
+            return path if path.startswith(root + os.sep) else None
+        return None
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture(status, response_headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = response_headers
+            return lambda data: None
+
+        body = self.application(environ, capture)
+        headers = {name.lower(): value for name, value in captured['headers']}
+        path = self.resolve(headers)
+        if path is None:
+            start_response(captured['status'], captured['headers'])
+            return body
+        if hasattr(body, 'close'):
+            body.close()
+
+        if not os.path.isfile(path):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+
+        size = os.path.getsize(path)
+        out = [(name, value) for name, value in captured['headers'] if name.lower() in PASSTHROUGH_HEADERS]
+        out.append(('Accept-Ranges', 'bytes'))
+        ranges = parse_range_header(environ.get('HTTP_RANGE'), size)
+        if ranges == []:
+            start_response('416 Range Not Satisfiable', [('Content-Range', f'bytes */{size}')])
+            return [b'']
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            status = '206 Partial Content'
+            out.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+        else:
+            start, end = 0, size - 1
+            status = '200 OK'
+        out.append(('Content-Length', str(end - start + 1)))
+        start_response(status, out)
+        return self.read_file(path, start, end)
+
+    def read_file(self, path, start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
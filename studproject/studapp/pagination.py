@@ -0,0 +1,121 @@
+"""Keyset (cursor) pagination for listings ordered newest first."""
+import base64
+import hashlib
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+
+APPROX_COUNT_TIMEOUT = 300  # seconds a cached listing total may be stale
+
+
+def encode_cursor(created_at, pk):
+    """Opaque `?after=` token for the row at (created_at, pk)."""
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor. Returns None for missing or garbled tokens."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """One page of a listing ordered by (-created_at, id).
+
+    Behaves like a list of objects in templates, and exposes `next_cursor`
+    instead of page numbers.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor, is_first, approximate_count):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+        self.approximate_count = approximate_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or not self.is_first
+
+
+def _approximate_count_key(cache_key):
+    return 'approx-count:' + hashlib.md5(cache_key.encode()).hexdigest()
+
+
+def approximate_count(queryset, cache_key):
+    """Row count for `queryset`, cached for a few minutes instead of counted every hit."""
+    key = _approximate_count_key(cache_key)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, APPROX_COUNT_TIMEOUT)
+    return count
+
+
+async def aapproximate_count(queryset, cache_key):
+    """Async version of approximate_count."""
+    key = _approximate_count_key(cache_key)
+    count = await cache.aget(key)
+    if count is None:
+        count = await queryset.order_by().acount()
+        await cache.aset(key, count, APPROX_COUNT_TIMEOUT)
+    return count
+
+
+def _after(queryset, after):
+    """(queryset from the `after` cursor on, decoded position)."""
+    queryset = queryset.order_by('-created_at', 'id')
+    position = decode_cursor(after)
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__gt=pk))
+    return queryset, position
+
+
+def _page(rows, per_page, position, total):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        if isinstance(last, dict):  # a .values() queryset
+            next_cursor = encode_cursor(last['created_at'], last['id'])
+        else:
+            next_cursor = encode_cursor(last.created_at, last.pk)
+    return KeysetPage(rows, next_cursor, is_first=position is None, approximate_count=total)
+
+
+def keyset_page(queryset, after=None, per_page=12, total=None):
+    """Fetch the `per_page` rows following the `after` cursor (one extra to detect a next page).
+
+    Works on model querysets and on `.values()` ones that include id and created_at.
+    """
+    queryset, position = _after(queryset, after)
+    return _page(list(queryset[:per_page + 1]), per_page, position, total)
+
+
+async def akeyset_page(queryset, after=None, per_page=12, total=None):
+    """Async version of keyset_page."""
+    queryset, position = _after(queryset, after)
+    return _page([row async for row in queryset[:per_page + 1]], per_page, position, total)
+
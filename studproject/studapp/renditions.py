@@ -0,0 +1,172 @@
+"""Small preview renditions of note files.
+
+Images are downscaled and PDFs get a raster of their first page, at a few
+fixed widths. Renditions live under MEDIA_ROOT/renditions/<identity>/,
+keyed by the file's identity (the SHA-256 in its content-addressed name),
+so a re-uploaded or unchanged file is never rendered twice. They are made
+by the `render_previews` job, queued when a note is published; until one
+exists, callers fall back to the original. `dedupe_media --gc` deletes
+them once no note uses their file.
+
+Needs Pillow, plus pypdfium2 for PDFs. Without them no renditions are
+made and everything keeps using the original files.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import default_storage
+
+from .storage import BLOB_DIR, note_storage
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+try:
+    import pypdfium2
+except ImportError:  # pragma: no cover - optional dependency
+    pypdfium2 = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTH = 320   # browse cards
+PREVIEW_WIDTH = 960     # preview modal
+WIDTHS = (THUMBNAIL_WIDTH, PREVIEW_WIDTH)
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+PDF_RENDER_SCALE = 2  # ~144 dpi, enough for the largest width
+RENDITION_DIR = 'renditions'
+
+
+def _extension(file_name):
+    return file_name.rsplit('.', 1)[-1].lower()
+
+
+def _format():
+    if Image is not None and features.check('webp'):
+        return 'webp'
+    return 'jpeg'
+
+
+def supports_file(file_name):
+    """Whether a rendition can be made for this stored file's type here."""
+    if not file_name or Image is None:
+        return False
+    ext = _extension(file_name)
+    return ext in IMAGE_EXTENSIONS or (ext == 'pdf' and pypdfium2 is not None)
+
+
+def supports(note):
+    return bool(note.file) and supports_file(note.file.name)
+
+
+def identity(file_name):
+    """Stable key for the file content: the hash part of its blob name."""
+    if file_name.startswith(f'{BLOB_DIR}/'):
+        return os.path.splitext(os.path.basename(file_name))[0]
+    # Files not yet moved by dedupe_media: key on the path instead
+    return hashlib.sha256(file_name.encode()).hexdigest()
+
+
+def rendition_name(file_name, width):
+    ext = 'jpg' if _format() == 'jpeg' else _format()
+    return f'{RENDITION_DIR}/{identity(file_name)}/w{width}.{ext}'
+
+
+def rendition_url(note, width):
+    """URL of a ready rendition, or None (callers use the original meanwhile).
+
+    Only looks at storage: renditions are queued when a note is published
+    (see `schedule`) or by generate_renditions, never from a read.
+    """
+    if not supports(note):
+        return None
+    name = rendition_name(note.file.name, width)
+    if default_storage.exists(name):
+        return default_storage.url(name)
+    return None
+
+
+def job_key(file_name):
+    # Notes sharing a blob share renditions, so one job covers them all
+    return _job_key(identity(file_name))
+
+
+def _job_key(file_identity):
+    return f'render_previews:{file_identity}'
+
+
+def schedule(note):
+    """Queue a render of `note`'s file once the transaction commits, unless it's queued already."""
+    if not supports(note):
+        return
+    from . import jobs
+    name = note.file.name
+    jobs.enqueue_on_commit('render_previews', {'file': name}, key=job_key(name))
+
+
+def _open_source(file_name):
+    """First page (PDF) or the image itself, as an RGB Pillow image."""
+    if _extension(file_name) == 'pdf':
+        pdf = pypdfium2.PdfDocument(note_storage.path(file_name))
+        try:
+            image = pdf[0].render(scale=PDF_RENDER_SCALE).to_pil()
+        finally:
+            pdf.close()
+    else:
+        with note_storage.open(file_name, 'rb') as f:
+            image = Image.open(f)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    return image.convert('RGB')
+
+
+def generate(file_name, force=False):
+    """Write every missing rendition of a stored file. Returns how many were written."""
+    if not supports_file(file_name):
+        return 0
+    missing = [w for w in WIDTHS if force or not default_storage.exists(rendition_name(file_name, w))]
+    if not missing:
+        return 0
+
+    source = _open_source(file_name)
+    for width in missing:
+        image = source.copy()
+        image.thumbnail((width, width * 4))
+        path = default_storage.path(rendition_name(file_name, width))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, _format(), quality=80)
+            os.chmod(tmp_path, default_storage.file_permissions_mode or 0o644)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return len(missing)
+
+
+# --------------- Garbage collection ---------------
+
+def orphaned(referenced_files, cutoff):
+    """Rendition directories whose file no note uses, untouched since `cutoff`: [(identity, path)]."""
+    root = default_storage.path(RENDITION_DIR)
+    if not os.path.isdir(root):
+        return []
+    live = {identity(name) for name in referenced_files}
+    return [
+        (entry.name, entry.path) for entry in os.scandir(root)
+        if entry.is_dir() and entry.name not in live and entry.stat().st_mtime <= cutoff
+    ]
+
+
+def release(file_identity):
+    """Delete the renditions of a file that's gone, and let it be rendered again if it comes back."""
+    from .models import Job
+    shutil.rmtree(default_storage.path(f'{RENDITION_DIR}/{file_identity}'), ignore_errors=True)
+    Job.objects.filter(key=_job_key(file_identity)).delete()
@@ -0,0 +1,62 @@
+"""Send the reads of read-only views to a separate read-only connection.
+
+Views wrapped in `read_only_view` read through DATABASE_READ_ALIAS, a
+second connection to the same SQLite file opened with `mode=ro`. With WAL
+(see studapp.dbprofile) those reads never wait for a writer, and a view
+that was meant to be read-only can't write by accident. Everything else,
+including every write, uses the default alias.
+"""
+import contextvars
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_read_only = contextvars.ContextVar('studapp_read_only', default=False)
+
+
+def read_alias():
+    alias = getattr(settings, 'DATABASE_READ_ALIAS', 'readonly')
+    return alias if alias in connections.settings else None
+
+
+def read_only_view(view):
+    """Decorator: the view's ORM reads go to the read-only alias. Sync or async views."""
+    if iscoroutinefunction(view):
+        # Async ORM calls copy this context into their worker thread
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _read_only.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_only.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+class ReadOnlyRouter:
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get():
+            return read_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Objects loaded through the read alias must still save to the default one
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # both aliases are the same database
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != read_alias()
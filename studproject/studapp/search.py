@@ -0,0 +1,228 @@
+"""Full-text search over notes, backed by SQLite FTS5 tables.
+
+`studapp_note_fts` holds each note's title, description, subject and
+branch. `studapp_page_fts` holds the text extracted from note files, one
+row per page, keyed by file name so notes sharing a blob share its rows.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import CharField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+FTS_TABLE = 'studapp_note_fts'
+PAGE_FTS_TABLE = 'studapp_page_fts'
+
+# Snippet markers: control characters that can't clash with escaped text
+MARK_START, MARK_END, FIELD_SEP = '\x02', '\x03', '\x1f'
+SNIPPET_TOKENS = 16
+
+# Relative column weights for bm25: title, description, subject, branch
+RANK_FUNCTION = 'bm25(10.0, 2.0, 5.0, 3.0)'
+
+INDEX_SELECT_SQL = (
+    'SELECT n.id, n.title, n.description, s.name, COALESCE(b.name, \'\') '
+    'FROM studapp_note n '
+    'INNER JOIN studapp_subject s ON s.id = n.subject_id '
+    'LEFT JOIN studapp_branch b ON b.id = s.branch_id'
+)
+
+
+def is_available():
+    """FTS5 is only used on SQLite; other backends fall back to icontains."""
+    return connection.vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    """Turn free text into an FTS5 expression: every word, prefix-matched."""
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _matching_ids_sql(expression):
+    """SQL and params for the ids of notes matching in their details or in their file's text."""
+    return (
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        f' UNION SELECT n.id FROM {PAGE_FTS_TABLE} p INNER JOIN studapp_note n ON n.file = p.file'
+        f' WHERE p.{PAGE_FTS_TABLE} MATCH %s',
+        (expression, expression),
+    )
+
+
+def match_notes(notes, query):
+    """Filter a Note queryset to the notes matching `query`, leaving the order alone."""
+    expression = build_match_expression(query)
+    if not expression or not is_available():
+        # File text is only in the page index, so this matches on the details alone
+        return notes.filter(
+            Q(title__icontains=query) | Q(description__icontains=query) |
+            Q(subject__name__icontains=query) | Q(subject__branch__name__icontains=query)
+        )
+    return notes.filter(id__in=RawSQL(*_matching_ids_sql(expression)))
+
+
+def search_notes(notes, query):
+    """Filter a Note queryset by `query` and order it by relevance.
+
+    Notes match on their details or on the text inside their file. Each
+    result carries `search_snippet` (see `snippet_html`) from the best
+    matching page of the file, or None if only the details matched.
+    Full-text results come back as `RankedResults`, which Paginator can page.
+    """
+    expression = build_match_expression(query)
+    if not expression or not is_available():
+        return match_notes(notes, query).annotate(
+            search_snippet=Value(None, output_field=CharField()),
+        ).order_by('-created_at', 'id')
+    return RankedResults(notes, query, expression)
+
+
+# One row per match from either index, joined to the caller's filtered notes
+# and ranked there; LIMIT lets SQLite keep only the best rows while sorting.
+# bm25 is negative, lower is better; a note matching both ways beats either
+# alone, and ties go to the newer note.
+RANKED_SQL = (
+    'SELECT f.id, SUM(m.rank) AS score FROM ('
+    f'SELECT rowid AS id, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    f' UNION ALL SELECT n.id, MIN(p.rank) FROM {PAGE_FTS_TABLE} p INNER JOIN studapp_note n ON n.file = p.file'
+    f' WHERE p.{PAGE_FTS_TABLE} MATCH %s GROUP BY n.id'
+    ') m INNER JOIN ({filtered}) f ON f.id = m.id'
+    ' GROUP BY f.id ORDER BY score, f.created_at DESC, f.id LIMIT %s OFFSET %s'
+)
+
+
+class RankedResults:
+    """Search results, best first, ranked in SQL a slice at a time; Paginator can page them."""
+
+    def __init__(self, notes, query, expression):
+        self.notes = notes
+        self.query = query
+        self.expression = expression
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = match_notes(self.notes, self.query).count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1 or None][0]
+        start = key.start or 0
+        stop = self.count() if key.stop is None else key.stop
+        if stop <= start:
+            return []
+        db = connections[self.notes.db]
+        # The caller's branch/subject filters, as a subquery the ranking can join
+        filtered = self.notes.order_by().values('id', 'created_at').query.get_compiler(using=self.notes.db)
+        filtered_sql, filtered_params = filtered.as_sql()
+        with db.cursor() as cursor:
+            cursor.execute(
+                RANKED_SQL.format(filtered=filtered_sql),
+                [self.expression, self.expression, *filtered_params, stop - start, start],
+            )
+            ranks = dict(cursor.fetchall())
+        loaded = self.notes.order_by().in_bulk(list(ranks))
+        rows = [loaded[note_id] for note_id in ranks if note_id in loaded]
+        snippets = _snippets(self.expression, {note.file.name for note in rows}, db)
+        for note in rows:
+            note.search_rank = ranks[note.id]
+            note.search_snippet = snippets.get(note.file.name)
+        return rows
+
+
+def _snippets(expression, files, db):
+    """{file name: search_snippet} from the best matching page of each file."""
+    files = [name for name in files if name]
+    if not files:
+        return {}
+    placeholders = ', '.join(['%s'] * len(files))
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT file, page || char(31) || snippet({PAGE_FTS_TABLE}, 0, char(2), char(3), '…', {SNIPPET_TOKENS})"
+            f' FROM {PAGE_FTS_TABLE} WHERE {PAGE_FTS_TABLE} MATCH %s AND file IN ({placeholders})'
+            f' ORDER BY rank',
+            [expression, *files],
+        )
+        snippets = {}
+        for name, snippet in cursor.fetchall():
+            snippets.setdefault(name, snippet)
+    return snippets
+
+
+def snippet_html(raw):
+    """Split a `search_snippet` value into (page number, HTML with <mark>ed terms)."""
+    if not raw:
+        return None, None
+    page, _, text = raw.partition(FIELD_SEP)
+    text = escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return int(page), mark_safe(text)
+
+
+# --------------- Index maintenance ---------------
+
+def index_notes(note_ids):
+    """(Re)index the given notes from their current database rows."""
+    note_ids = list(note_ids)
+    if not note_ids or not is_available():
+        return
+    placeholders = ', '.join(['%s'] * len(note_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', note_ids)
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description, subject, branch) '
+            f'{INDEX_SELECT_SQL} WHERE n.id IN ({placeholders})',
+            note_ids,
+        )
+
+
+def remove_notes(note_ids):
+    """Drop the given notes from the index."""
+    note_ids = list(note_ids)
+    if not note_ids or not is_available():
+        return
+    placeholders = ', '.join(['%s'] * len(note_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', note_ids)
+
+
+def rebuild_index():
+    """Rebuild the whole index from scratch. Returns the number of notes indexed."""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, title, description, subject, branch) {INDEX_SELECT_SQL}')
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', %s)", [RANK_FUNCTION])
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+# --------------- Page index (extracted file text) ---------------
+
+def index_pages(file_name, pages):
+    """Replace the indexed pages of `file_name` with `pages` (a list of strings)."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PAGE_FTS_TABLE} WHERE file = %s', [file_name])
+        cursor.executemany(
+            f'INSERT INTO {PAGE_FTS_TABLE} (body, file, page) VALUES (%s, %s, %s)',
+            [(text, file_name, number) for number, text in enumerate(pages, start=1) if text.strip()],
+        )
+
+
+def remove_pages(file_name):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PAGE_FTS_TABLE} WHERE file = %s', [file_name])
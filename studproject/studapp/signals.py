@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from . import bookmarks, counters, extraction, navigation, search, stats
+from .models import Bookmark, Comment, Note, Subject, Branch
+
+
+# --------------- Search index ---------------
+
+@receiver(post_save, sender=Note)
+def index_saved_note(sender, instance, **kwargs):
+    search.index_notes([instance.pk])
+
+
+@receiver(post_delete, sender=Note)
+def unindex_deleted_note(sender, instance, **kwargs):
+    search.remove_notes([instance.pk])
+    # Extracted text is per file; it goes with the last note using the file
+    extraction.release(instance.file.name)
+
+
+@receiver(post_save, sender=Subject)
+def reindex_subject_notes(sender, instance, created, **kwargs):
+    # A renamed subject changes the indexed text of every note under it
+    if not created:
+        search.index_notes(instance.notes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Branch)
+def reindex_branch_notes(sender, instance, created, **kwargs):
+    if not created:
+        search.index_notes(Note.objects.filter(subject__branch=instance).values_list('id', flat=True))
+
+
+# --------------- Stored counters ---------------
+# Every write path, cascades included, goes through these; see studapp.counters.
+# Fixture loads (raw=True) bring their own counter values.
+
+@receiver(pre_save, sender=Note)
+def remember_note_subject(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._saved_subject_id = (
+            Note.objects.filter(pk=instance.pk).values_list('subject_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Note)
+def count_saved_note(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.adjust_note_count(instance.subject_id, +1)
+        return
+    previous = getattr(instance, '_saved_subject_id', None)
+    if previous is not None and previous != instance.subject_id:
+        counters.adjust_note_count(previous, -1)
+        counters.adjust_note_count(instance.subject_id, +1)
+
+
+@receiver(post_delete, sender=Note)
+def uncount_deleted_note(sender, instance, **kwargs):
+    counters.adjust_note_count(instance.subject_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.adjust_comment_count(instance.note_id, +1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    counters.adjust_comment_count(instance.note_id, -1)
+
+
+@receiver(post_save, sender=Bookmark)
+def count_saved_bookmark(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.adjust_bookmark_count(instance.note_id, +1)
+
+
+@receiver(post_delete, sender=Bookmark)
+def uncount_deleted_bookmark(sender, instance, **kwargs):
+    counters.adjust_bookmark_count(instance.note_id, -1)
+
+
+# --------------- Per-user bookmark cache ---------------
+# Bookmarks also go when their note or user is deleted, not only through
+# toggle_bookmark; dropped on commit, like the stats below
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_delete, sender=Bookmark)
+def invalidate_bookmarks(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bookmarks.invalidate(user_id))
+
+
+# --------------- Navigation tree ---------------
+# On commit: a reader rebuilding the tree mid-transaction would otherwise
+# cache the old rows under the new version for a day
+
+@receiver([post_save, post_delete], sender=Branch)
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_navigation(sender, **kwargs):
+    transaction.on_commit(navigation.invalidate)
+
+
+# --------------- Home page and dashboard stats ---------------
+
+# Dropped once the write commits, so a rolled-back upload changes nothing and
+# a concurrent reader can't cache the totals from before it
+
+@receiver(post_save, sender=Note)
+def refresh_stats_for_created_note(sender, instance, created, **kwargs):
+    if created:
+        _invalidate_stats_on_commit(instance)
+
+
+@receiver(post_delete, sender=Note)
+def refresh_stats_for_deleted_note(sender, instance, **kwargs):
+    _invalidate_stats_on_commit(instance)
+
+
+def _invalidate_stats_on_commit(note):
+    user_id = note.uploaded_by_id
+    transaction.on_commit(stats.invalidate)
+    transaction.on_commit(lambda: stats.invalidate_user_summary(user_id))
+
+
+@receiver([post_save, post_delete], sender=Branch)
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_stats(sender, **kwargs):
+    # Branch totals and featured subject IDs may have moved; rebuild on next read
+    transaction.on_commit(stats.invalidate)
+
@@ -0,0 +1,76 @@
+"""Cached site statistics for the home page, and per-user totals for the dashboard."""
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from . import bookmarks
+from .models import Branch, Note, Subject
+
+SNAPSHOT_KEY = 'home-stats'
+# Rebuilt from the stored note_count columns (three cheap queries), so a
+# short lifetime costs little and bounds any drift
+SNAPSHOT_TIMEOUT = 60
+USER_SUMMARY_TIMEOUT = 300  # seconds; downloads received may lag this much
+
+# The four FE subjects linked from the home page hero cards
+FEATURED_SUBJECTS = {
+    'math': 'Engineering Mathematics-I',
+    'mechanics': 'Engineering Mechanics',
+    'electrical': 'Basic Electrical Engineering',
+    'chemistry': 'Engineering Chemistry',
+}
+
+
+def build_snapshot():
+    """Compute the snapshot from the stored counters (three queries)."""
+    branch_note_counts = dict(Branch.objects.values_list('id', 'note_count'))
+    featured_ids = {}
+    for subject_id, name in Subject.objects.filter(name__in=FEATURED_SUBJECTS.values()).values_list('id', 'name'):
+        featured_ids.setdefault(name, subject_id)
+    return {
+        'total_notes': Subject.objects.aggregate(total=Sum('note_count'))['total'] or 0,
+        'total_branches': len(branch_note_counts),
+        'branch_note_counts': branch_note_counts,
+        'featured_subjects': {
+            key: featured_ids[name] for key, name in FEATURED_SUBJECTS.items() if name in featured_ids
+        },
+    }
+
+
+def refresh_snapshot():
+    snapshot = build_snapshot()
+    cache.set(SNAPSHOT_KEY, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def get_snapshot():
+    """Return the cached snapshot, computing it on a cold cache."""
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = refresh_snapshot()
+    return snapshot
+
+
+def invalidate():
+    cache.delete(SNAPSHOT_KEY)
+
+
+# --------------- Per-user summary ---------------
+
+def _user_summary_key(user_id):
+    return f'user-summary:{user_id}'
+
+
+def get_user_summary(user_id):
+    """{'uploads', 'downloads', 'bookmarks'} for the dashboard: one aggregate query, cached."""
+    summary = cache.get(_user_summary_key(user_id))
+    if summary is None:
+        summary = Note.objects.filter(uploaded_by_id=user_id).aggregate(
+            uploads=Count('id'), downloads=Sum('downloads', default=0),
+        )
+        cache.set(_user_summary_key(user_id), summary, USER_SUMMARY_TIMEOUT)
+    # Bookmarks have their own cached count, invalidated on every toggle
+    return dict(summary, bookmarks=bookmarks.count(user_id))
+
+
+def invalidate_user_summary(user_id):
+    cache.delete(_user_summary_key(user_id))
@@ -0,0 +1,76 @@
+"""Content-addressed storage for note files.
+
+Every distinct file is stored once under `blobs/<aa>/<sha256><ext>`, so a
+re-uploaded PDF costs no extra disk. A blob's reference count is simply
+the number of notes whose `file` points at it.
+
+Blobs are never deleted when their last note goes: an upload of the same
+content may be reusing the blob in a transaction that hasn't committed
+yet, so no reference shows up. `manage.py dedupe_media --gc` deletes
+unreferenced blobs once they are older than BLOB_GC_GRACE, and reusing a
+blob touches it, which restarts that clock.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+BLOB_DIR = 'blobs'
+CHUNK_SIZE = 64 * 1024
+BLOB_GC_GRACE = 60 * 60  # seconds an unreferenced blob is kept after its last write or reuse
+
+
+def file_sha256(fileobj):
+    """SHA-256 hex digest of an open binary file, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_name(digest, original_name):
+    """Storage name for content with `digest`; keeps the (lower-cased) extension."""
+    ext = os.path.splitext(original_name)[1].lower()
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}{ext}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Names files by their SHA-256 and skips the write when the blob exists."""
+
+    def _save(self, name, content):
+        incoming_dir = os.path.join(self.location, BLOB_DIR, 'incoming')
+        os.makedirs(incoming_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=incoming_dir)
+        try:
+            # Hash while copying, so the upload is read exactly once
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            name = blob_name(digest.hexdigest(), name)
+            self.commit_blob(tmp_path, name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    def commit_blob(self, source_path, name):
+        """Move a fully written file into place as blob `name`, unless it already exists."""
+        path = self.path(name)
+        if os.path.exists(path):
+            os.utime(path)  # reused: keep it out of the next garbage collection
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return True
+
+
+note_storage = ContentAddressedStorage()
+
+
+def get_note_storage():
+    return note_storage
@@ -0,0 +1,29 @@
+"""Background tasks run by the job queue (see studapp.jobs)."""
+from . import extraction, jobs, renditions
+from .models import Note
+
+
+@jobs.task('render_previews')
+def render_previews(file=None, note_id=None):
+    # Keyed by file, not by note: the note that queued it may be gone, others not
+    if note_id is not None:  # queued before renditions were keyed by file
+        file = Note.objects.filter(id=note_id).values_list('file', flat=True).first()
+    if file and Note.objects.filter(file=file).exists():
+        renditions.generate(file)
+
+
+@jobs.task('extract_text')
+def extract_text(file=None, note_id=None):
+    # Keyed by file too: any note still using it will do
+    if note_id is not None:  # queued before extraction was keyed by file
+        file = Note.objects.filter(id=note_id).values_list('file', flat=True).first()
+    note = Note.objects.filter(file=file).first() if file else None
+    if note:
+        extraction.extract(note)
+
+
+def enqueue_post_upload(note):
+    """Queue everything that follows an upload, to run after the request commits."""
+    renditions.schedule(note)
+    if extraction.supports(note):
+        jobs.enqueue_on_commit('extract_text', {'file': note.file.name}, key=extraction.job_key(note))
@@ -1,3 +1,1210 @@
-from django.test import TestCase
+"""Tests for studapp.
 
-# Create your tests here.
+`QueryPlanTests` requests each view, runs `EXPLAIN QUERY PLAN` on every
+SELECT it issued and fails if SQLite would read a whole table or sort rows
+in a temp B-tree (full-text results excepted: they can only be sorted once
+found). Those plans are cheap on a test database and slow on a real one,
+so this catches a missing index or an unindexable filter before it ships.
+The other classes cover the notes API, navigation, search and text
+extraction, bookmarks, the JSON actions, the dashboard, counters, file
+delivery, text previews, renditions, jobs, chunked uploads, the request
+metrics, the catalog command and the database profile (the only class
+that reads through the real read-only alias).
+"""
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core import signals
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, OperationalError, close_old_connections, connection, connections, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import bookmarks, extraction, jobs, metrics, navigation, renditions, search, stats, uploads
+from .counters import DownloadCounter, download_counter
+from .dbprofile import retry_on_busy
+from .delivery import _if_range_matches, _text_preview_chunks, delivery_mode, file_etag, parse_range_header
+from .middleware import RequestMetricsMiddleware
+from .offload import OffloadStandIn
+from .storage import note_storage
+from .models import Bookmark, Branch, Comment, ExtractedText, Job, Note, Subject, UploadSession
+from .pagination import encode_cursor
+from .tasks import enqueue_post_upload
+
+TABLE = re.compile(r'^(?:SCAN|SEARCH) (\w+)')
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')  # "SCAN t USING [COVERING] INDEX …" walks an index instead
+FTS_SCAN = re.compile(r'^SCAN \w+ VIRTUAL TABLE INDEX')
+MATERIALIZED = re.compile(r'^MATERIALIZE (\w+)$')
+TEMP_SORT = re.compile(r'^USE TEMP B-TREE FOR (?:.* )?ORDER BY$')
+# Small tables that are read whole on purpose (the cached navigation tree)
+LOOKUP_TABLES = {'studapp_branch', 'studapp_subject'}
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# The read-only alias is a second connection to the test database, which
+# can't see rows from the test's open transaction; read through default
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_READ_ALIAS='default')
+class StudappTestCase(TestCase):
+    """Starts each test with an empty cache, logged in as `cls.user` if the class sets one."""
+    user = None
+
+    def setUp(self):
+        cache.clear()
+        if self.user is not None:
+            self.client.force_login(self.user)
+
+
+class QueryPlanTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', password='pass')
+        cls.branch = Branch.objects.create(name='Computer Science', icon='💻')
+        cls.subject = Subject.objects.create(name='Operating Systems', branch=cls.branch, icon='🖥️')
+        Subject.objects.create(name='Compilers', branch=cls.branch, icon='⚙️')
+        cls.notes = [
+            Note.objects.create(
+                title=f'Unit {i} notes', description='Scheduling and memory management',
+                subject=cls.subject, uploaded_by=cls.user,
+            )
+            for i in range(15)
+        ]
+        cls.note = cls.notes[0]
+        for note in cls.notes[:5]:
+            Bookmark.objects.create(user=cls.user, note=note)
+        for i in range(25):
+            Comment.objects.create(note=cls.note, user=cls.user, text=f'Comment {i}')
+        search.rebuild_index()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertIndexedPlans(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+
+        problems = []
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            if {m.group(1) for m in map(TABLE.match, plan) if m} <= LOOKUP_TABLES:
+                continue
+            if any(FTS_SCAN.match(line) for line in plan):
+                # Matches come from the full-text index and can only be ranked or
+                # ordered once found; LIMIT keeps that to a top-N sort. Scanning
+                # the matches it materialized is fine; scanning a table isn't.
+                materialized = {m.group(1) for m in map(MATERIALIZED.match, plan) if m}
+                if any(m and m.group(1) not in materialized for m in map(FULL_SCAN.match, plan)):
+                    problems.append(sql + '\n  ' + '\n  '.join(plan))
+                continue
+            if any(FULL_SCAN.match(line) for line in plan) or any(TEMP_SORT.match(line) for line in plan):
+                problems.append(sql + '\n  ' + '\n  '.join(plan))
+        self.assertFalse(problems, f'{url} has unindexed queries:\n' + '\n\n'.join(problems))
+
+    def test_home(self):
+        self.assertIndexedPlans(reverse('home'))
+
+    def test_browse(self):
+        self.assertIndexedPlans(reverse('browse'))
+
+    def test_browse_next_page(self):
+        cursor = encode_cursor(self.notes[-1].created_at, self.notes[-1].id)
+        self.assertIndexedPlans(f"{reverse('browse')}?after={cursor}")
+
+    def test_browse_numbered_page(self):
+        self.assertIndexedPlans(f"{reverse('browse')}?page=2")
+
+    def test_browse_branch(self):
+        self.assertIndexedPlans(f"{reverse('browse')}?branch={self.branch.id}")
+
+    def test_browse_subject(self):
+        self.assertIndexedPlans(f"{reverse('browse')}?subject={self.subject.id}")
+
+    def test_browse_search(self):
+        self.assertIndexedPlans(f"{reverse('browse')}?q=scheduling")
+
+    def test_browse_branch_search(self):
+        self.assertIndexedPlans(f"{reverse('browse')}?branch={self.branch.id}&q=unit")
+
+    def test_dashboard(self):
+        self.assertIndexedPlans(reverse('dashboard'))
+
+    def test_dashboard_notes(self):
+        self.assertIndexedPlans(reverse('dashboard_notes'))
+
+    def test_dashboard_bookmarks(self):
+        self.assertIndexedPlans(reverse('dashboard_bookmarks'))
+
+    def test_dashboard_bookmarks_next_page(self):
+        bookmark = Bookmark.objects.filter(user=self.user).order_by('-created_at', 'id')[2]
+        cursor = encode_cursor(bookmark.created_at, bookmark.id)
+        self.assertIndexedPlans(f"{reverse('dashboard_bookmarks')}?after={cursor}")
+
+    def test_note_comments(self):
+        self.assertIndexedPlans(reverse('note_comments', args=[self.note.id]))
+
+    def test_note_comments_next_page(self):
+        comment = Comment.objects.filter(note=self.note).order_by('-created_at', 'id')[19]
+        cursor = encode_cursor(comment.created_at, comment.id)
+        self.assertIndexedPlans(f"{reverse('note_comments', args=[self.note.id])}?after={cursor}")
+
+    def test_get_subjects(self):
+        self.assertIndexedPlans(reverse('get_subjects', args=[self.branch.id]))
+
+    def test_notes_api(self):
+        self.assertIndexedPlans(f"{reverse('notes_api')}?fields=id,title,subject,branch,uploader,filename")
+
+    def test_notes_api_branch(self):
+        self.assertIndexedPlans(f"{reverse('notes_api')}?branch={self.branch.id}")
+
+    def test_notes_api_search(self):
+        self.assertIndexedPlans(f"{reverse('notes_api')}?q=scheduling")
+
+
+class NotesApiTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reader', password='pass')
+        branch = Branch.objects.create(name='Mechanical', icon='⚙️')
+        subject = Subject.objects.create(name='Thermodynamics', branch=branch, icon='🔥')
+        cls.notes = [
+            Note.objects.create(title=f'Cycle {i}', subject=subject, uploaded_by=user) for i in range(5)
+        ]
+        cls.url = reverse('notes_api')
+
+    def test_fields_and_cursor(self):
+        response = self.client.get(self.url, {'fields': 'id,title,download_url', 'limit': 3})
+        data = response.json()
+        self.assertEqual(len(data['notes']), 3)
+        self.assertEqual(set(data['notes'][0]), {'id', 'title', 'download_url'})
+        rest = self.client.get(self.url, {'fields': 'id', 'limit': 3, 'after': data['next']}).json()
+        self.assertIsNone(rest['next'])
+        ids = [row['id'] for row in data['notes'] + rest['notes']]
+        self.assertEqual(sorted(ids), sorted(note.id for note in self.notes))
+
+    def test_search_cursor(self):
+        data = self.client.get(self.url, {'q': 'cycle', 'fields': 'id', 'limit': 2}).json()
+        ids = [row['id'] for row in data['notes']]
+        while data['next']:
+            data = self.client.get(self.url, {'q': 'cycle', 'fields': 'id', 'limit': 2, 'after': data['next']}).json()
+            ids.extend(row['id'] for row in data['notes'])
+        self.assertEqual(ids, [note.id for note in reversed(self.notes)])
+
+    def test_unknown_field(self):
+        response = self.client.get(self.url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url, {'fields': 'id,title,downloads'})
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,title,downloads'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Edits and counter bumps (which leave updated_at alone) both change it
+        Note.objects.filter(id=self.notes[0].id).update(downloads=7)
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,title,downloads'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(self.url, {'fields': 'id,title'})['ETag']
+        self.notes[1].title = 'Renamed'
+        self.notes[1].save()
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,title'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class NavigationTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Instrumentation', icon='🎛️')
+        cls.subject = Subject.objects.create(name='Sensors', branch=cls.branch, icon='🌡️')
+
+    def test_renames_show_up_once_committed(self):
+        self.assertContains(self.client.get(reverse('home')), 'Instrumentation')  # tree now cached
+        self.branch.name = 'Instrumentation and Control'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.branch.save()
+        self.assertContains(self.client.get(reverse('home')), 'Instrumentation and Control')
+
+        self.subject.name = 'Transducers'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subject.save()
+        subjects = self.client.get(reverse('get_subjects', args=[self.branch.id])).json()
+        self.assertEqual([subject['name'] for subject in subjects], ['Transducers'])
+        self.assertContains(self.client.get(reverse('browse')), 'Transducers')
+
+    def test_invalidated_on_commit_only(self):
+        before = navigation.get_tree()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Subject.objects.create(name='Actuators', branch=self.branch, icon='⚙️')
+        # Until the transaction commits, readers keep the old tree
+        self.assertEqual(navigation.get_tree(), before)
+        for callback in callbacks:
+            callback()
+        self.assertIn('Actuators', [s['name'] for b in navigation.get_tree() for s in b['subjects']])
+
+
+class SearchTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('searcher', password='pass')
+        cls.branch = Branch.objects.create(name='Electronics', icon='📡')
+        subject = Subject.objects.create(name='Signals and Systems', branch=cls.branch, icon='〰️')
+        other = Subject.objects.create(name='Optics', branch=Branch.objects.create(name='Physics', icon='🔬'), icon='🔭')
+        cls.in_description = Note.objects.create(
+            title='Unit 3', description='Fourier series worked examples', subject=subject, uploaded_by=user,
+        )
+        cls.in_title = Note.objects.create(title='Fourier series', subject=subject, uploaded_by=user)
+        Note.objects.create(title='Fourier optics', subject=other, uploaded_by=user)
+        cls.drills = [Note.objects.create(title=f'Drill {i}', subject=subject, uploaded_by=user) for i in range(14)]
+        search.rebuild_index()
+
+    def test_ranked_within_the_filters(self):
+        results = search.search_notes(Note.objects.filter(subject__branch=self.branch), 'fourier')
+        self.assertEqual(results.count(), 2)
+        self.assertEqual(list(results), [self.in_title, self.in_description])  # title outweighs description
+
+    def test_pages_are_ranked_in_sql(self):
+        paginator = Paginator(search.search_notes(Note.objects.all(), 'drill'), 12)
+        self.assertEqual(paginator.count, 14)
+        with CaptureQueriesContext(connection) as captured:
+            first = list(paginator.page(1))
+        self.assertEqual(len(captured), 2)  # the ranked page's ids, then those notes
+        second = list(paginator.page(2))
+        self.assertEqual(len(first) + len(second), 14)
+        self.assertEqual(set(first + second), set(self.drills))
+        # Equal ranks go to the newer note
+        self.assertEqual(first[0], self.drills[-1])
+
+
+def minimal_pdf(*pages):
+    """A PDF with one line of Helvetica text per page."""
+    count = len(pages)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % (4 + 2 * i) for i in range(count)), count),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for i, text in enumerate(pages):
+        stream = b'BT /F1 12 Tf 72 720 Td (%s) Tj ET' % text.encode('latin-1')
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (5 + 2 * i)
+        )
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    pdf, offsets = b'%PDF-1.4\n', []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    pdf += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    return pdf + b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+
+
+class ExtractionTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='pass')
+        branch = Branch.objects.create(name='Mathematics', icon='➗')
+        cls.subject = Subject.objects.create(name='Transforms', branch=branch, icon='∿')
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def upload(self, filename, data, title='Unit 4'):
+        """Create a note as the upload views do and run the jobs it queues."""
+        with self.captureOnCommitCallbacks(execute=True):
+            note = Note.objects.create(
+                title=title, subject=self.subject, uploaded_by=self.user,
+                file=note_storage.save(filename, ContentFile(data)),
+            )
+            enqueue_post_upload(note)
+        while job := jobs.claim('worker'):
+            jobs.run_job(job)
+        return note
+
+    def found(self, query):
+        return list(search.search_notes(Note.objects.all(), query))
+
+    def test_text_files_are_cut_into_pages(self):
+        lines = [f'{i}: the z-transform of a sequence\n' for i in range(extraction.TEXT_PAGE_LINES * 2 + 10)]
+        note = self.upload('z.txt', ''.join(lines).encode())
+        self.assertEqual(ExtractedText.objects.get(file=note.file.name).pages, 3)
+        self.assertEqual(self.found('sequence'), [note])
+
+    def test_text_encodings(self):
+        def pages(data):
+            return extraction.extract_pages(Note(file=note_storage.save('t.txt', ContentFile(data))))
+
+        self.assertEqual(pages('Fonction de transfert: café'.encode('latin-1')), ['Fonction de transfert: café'])
+        with override_settings(TEXT_EXTRACT_MAX_CHARS=2):
+            # The read stops two bytes into '€': a cut character, not latin-1
+            self.assertEqual(pages('ééé€'.encode()), ['éé'])
+
+    @skipUnless(extraction.pypdfium2, 'needs pypdfium2')
+    def test_pdf_pages_are_searchable_with_a_snippet(self):
+        note = self.upload('unit4.pdf', minimal_pdf('Fourier series', 'Laplace transform of a step'))
+        self.assertEqual(ExtractedText.objects.get(file=note.file.name).pages, 2)
+        [found] = self.found('laplace')
+        self.assertEqual(found, note)
+        self.assertEqual(search.snippet_html(found.search_snippet), (2, '<mark>Laplace</mark> transform of a step'))
+
+    def test_text_is_released_with_the_last_note_using_the_file(self):
+        data = b'Nyquist sampling theorem'
+        first, second = self.upload('nyquist.txt', data), self.upload('copy.txt', data, 'Unit 4 (copy)')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Job.objects.filter(key=extraction.job_key(first)).count(), 1)  # extracted once
+
+        first.delete()
+        self.assertEqual(self.found('nyquist'), [second])
+        second.delete()
+        self.assertFalse(ExtractedText.objects.exists())
+        self.assertEqual(self.found('nyquist'), [])
+        self.assertFalse(Job.objects.filter(key=extraction.job_key(first)).exists())
+
+
+class BookmarkCacheTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('collector', password='pass')
+        branch = Branch.objects.create(name='Civil', icon='🏗️')
+        subject = Subject.objects.create(name='Surveying', branch=branch, icon='📐')
+        cls.notes = [Note.objects.create(title=f'Sheet {i}', subject=subject, uploaded_by=cls.user) for i in range(4)]
+        Bookmark.objects.create(user=cls.user, note=cls.notes[0])
+        Bookmark.objects.create(user=cls.user, note=cls.notes[3])
+
+    def test_membership_is_scoped_and_cached(self):
+        ids = [note.id for note in self.notes[:2]]
+        with self.assertNumQueries(1):
+            self.assertEqual(bookmarks.bookmarked_among(self.user.id, ids), {self.notes[0].id})
+        with self.assertNumQueries(0):
+            self.assertEqual(bookmarks.bookmarked_among(self.user.id, ids), {self.notes[0].id})
+
+    def test_toggle_invalidates(self):
+        ids = [note.id for note in self.notes]
+        self.assertEqual(bookmarks.bookmarked_among(self.user.id, ids), {self.notes[0].id, self.notes[3].id})
+        self.assertEqual(bookmarks.count(self.user.id), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('toggle_bookmark', args=[self.notes[1].id]))
+        self.assertEqual(bookmarks.bookmarked_among(self.user.id, ids), {self.notes[0].id, self.notes[1].id, self.notes[3].id})
+        self.assertEqual(bookmarks.count(self.user.id), 3)
+        response = self.client.get(reverse('browse'))
+        self.assertEqual(response.context['bookmarked_ids'], {self.notes[0].id, self.notes[1].id, self.notes[3].id})
+
+    def test_cascaded_deletes_invalidate(self):
+        self.assertEqual(bookmarks.count(self.user.id), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notes[3].delete()  # takes its bookmark with it
+        self.assertEqual(bookmarks.count(self.user.id), 1)
+        self.assertEqual(bookmarks.bookmarked_among(self.user.id, [self.notes[0].id]), {self.notes[0].id})
+
+
+class JsonActionTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clicker', password='pass')
+        cls.other = User.objects.create_user('bystander', password='pass')
+        branch = Branch.objects.create(name='Electrical', icon='⚡')
+        subject = Subject.objects.create(name='Circuits', branch=branch, icon='🔌')
+        cls.note = Note.objects.create(title='Kirchhoff', subject=subject, uploaded_by=cls.user)
+
+    def post_json(self, url, data=None):
+        return self.client.post(url, data or {}, HTTP_ACCEPT='application/json')
+
+    def test_toggle_bookmark(self):
+        url = reverse('toggle_bookmark', args=[self.note.id])
+        # The user's cached total is invalidated on commit, which a TestCase only simulates
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.post_json(url).json()
+        self.assertEqual(data, {'bookmarked': True, 'bookmark_count': 1, 'user_bookmark_count': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.post_json(url).json()
+        self.assertEqual((data['bookmarked'], data['bookmark_count']), (False, 0))
+        self.assertEqual(bookmarks.count(self.user.id), 0)
+        self.assertFalse(Bookmark.objects.exists())
+
+    def test_add_and_delete_comment(self):
+        response = self.post_json(reverse('add_comment', args=[self.note.id]), {'text': 'Loop rule'})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['comment_count'], 1)
+        self.assertEqual(data['comment']['text'], 'Loop rule')
+
+        response = self.post_json(data['comment']['delete_url'])
+        self.assertEqual(response.json(), {'deleted': data['comment']['id'], 'comment_count': 0})
+
+    def test_comment_errors(self):
+        self.assertEqual(self.post_json(reverse('add_comment', args=[self.note.id]), {'text': ''}).status_code, 400)
+        comment = Comment.objects.create(note=self.note, user=self.other, text='Not yours')
+        self.assertEqual(self.post_json(reverse('delete_comment', args=[comment.id])).status_code, 403)
+        self.assertTrue(Comment.objects.filter(id=comment.id).exists())
+
+    def test_redirects_without_json(self):
+        response = self.client.get(reverse('toggle_bookmark', args=[self.note.id]))
+        self.assertRedirects(response, reverse('browse'), fetch_redirect_response=False)
+
+
+class DashboardTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('contributor', password='pass')
+        branch = Branch.objects.create(name='Chemical', icon='🧪')
+        cls.subject = Subject.objects.create(name='Mass Transfer', branch=branch, icon='⚗️')
+        cls.notes = [
+            Note.objects.create(title=f'Chapter {i}', subject=cls.subject, uploaded_by=cls.user, downloads=i)
+            for i in range(12)
+        ]
+        Bookmark.objects.create(user=cls.user, note=cls.notes[0])
+
+    def test_summary_is_cached(self):
+        self.assertEqual(stats.get_user_summary(self.user.id), {'uploads': 12, 'downloads': 66, 'bookmarks': 1})
+        with self.assertNumQueries(0):
+            stats.get_user_summary(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(title='Chapter 12', subject=self.subject, uploaded_by=self.user, downloads=4)
+        self.assertEqual(stats.get_user_summary(self.user.id)['uploads'], 13)
+
+    def test_sections_page_by_cursor(self):
+        data = self.client.get(reverse('dashboard_notes')).json()
+        self.assertEqual(data['html'].count('class="note-card"'), 10)
+        data = self.client.get(reverse('dashboard_notes'), {'after': data['next']}).json()
+        self.assertEqual(data['html'].count('class="note-card"'), 2)
+        self.assertIsNone(data['next'])
+        data = self.client.get(reverse('dashboard_bookmarks')).json()
+        self.assertIn(f'bookmark-note-{self.notes[0].id}', data['html'])
+
+    def test_profile_update_skips_sections(self):
+        stats.get_user_summary(self.user.id)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(reverse('dashboard'), {'update_profile': '1', 'first_name': 'Ada', 'last_name': 'L', 'email': ''})
+        self.assertFalse([query for query in captured if 'studapp_note' in query['sql'] or 'studapp_bookmark' in query['sql']])
+
+
+@override_settings(DOWNLOAD_COUNTER_FLUSH_INTERVAL=60)
+class DownloadCounterTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        uploader = User.objects.create_user('popular', password='pass')
+        subject = Subject.objects.create(name='Fluid Mechanics', icon='🌊')
+        cls.first = Note.objects.create(title='Bernoulli', subject=subject, uploaded_by=uploader)
+        cls.second = Note.objects.create(title='Reynolds', subject=subject, uploaded_by=uploader)
+
+    def setUp(self):
+        super().setUp()
+        self.counter = DownloadCounter()
+        self.counter._ensure_timer = lambda: None  # flushes are driven by hand here
+
+    def downloads(self, note):
+        return Note.objects.values_list('downloads', flat=True).get(id=note.id)
+
+    def test_increments_are_buffered_then_flushed(self):
+        for _ in range(3):
+            self.counter.increment(self.first.id)
+        self.counter.increment(self.second.id, 2)
+        self.assertEqual(self.counter.pending(self.first.id), 3)
+        self.assertEqual(self.downloads(self.first), 0)
+
+        self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual((self.downloads(self.first), self.downloads(self.second)), (3, 2))
+        self.assertEqual(self.counter.pending(self.first.id), 0)
+        self.assertEqual(self.counter.flush(), 0)
+
+    def test_failed_flush_keeps_increments(self):
+        self.counter.increment(self.first.id, 4)
+        with mock.patch('studapp.models.Note.objects.filter', side_effect=DatabaseError('locked')):
+            with self.assertLogs('studapp.counters', 'ERROR'):
+                self.assertEqual(self.counter.flush(), 0)
+        self.counter.increment(self.first.id)
+        self.assertEqual(self.counter.pending(self.first.id), 5)
+        self.counter.flush()
+        self.assertEqual(self.downloads(self.first), 5)
+
+    @override_settings(DOWNLOAD_COUNTER_FLUSH_INTERVAL=0)
+    def test_zero_interval_writes_through(self):
+        self.counter.increment(self.first.id)
+        self.assertEqual(self.downloads(self.first), 1)
+
+    def test_timer_flushes_and_stops_when_idle(self):
+        self.counter.increment(self.first.id, 2)
+        with override_settings(DOWNLOAD_COUNTER_FLUSH_INTERVAL=0.01), mock.patch('studapp.counters.connection'):
+            self.counter._run_timer()  # what the background thread runs
+        self.assertEqual(self.downloads(self.first), 2)
+        self.assertIsNone(self.counter._timer)
+
+    def test_forked_child_starts_empty(self):
+        self.counter.increment(self.first.id, 7)
+        self.counter._pid = -1  # as if this copy were inherited by a forked worker
+        self.counter.increment(self.first.id)
+        self.assertEqual(self.counter.pending(self.first.id), 1)
+
+
+class StoredCounterTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pass')
+        cls.reader = User.objects.create_user('reader2', password='pass')
+        cls.branch = Branch.objects.create(name='Aerospace', icon='✈️')
+        cls.subject = Subject.objects.create(name='Propulsion', branch=cls.branch, icon='🚀')
+        cls.other_subject = Subject.objects.create(name='Avionics', icon='📡')
+        cls.note = Note.objects.create(title='Nozzles', subject=cls.subject, uploaded_by=cls.author)
+
+    def counts(self):
+        self.note.refresh_from_db()
+        return (
+            Branch.objects.get(id=self.branch.id).note_count,
+            Subject.objects.get(id=self.subject.id).note_count,
+            self.note.comment_count,
+            self.note.bookmark_count,
+        )
+
+    def test_creates_and_deletes(self):
+        self.assertEqual(self.counts(), (1, 1, 0, 0))
+        comment = Comment.objects.create(note=self.note, user=self.reader, text='Nice')
+        Bookmark.objects.create(note=self.note, user=self.reader)
+        self.assertEqual(self.counts(), (1, 1, 1, 1))
+        comment.delete()
+        self.assertEqual(self.counts(), (1, 1, 0, 1))
+
+    def test_cascades(self):
+        Comment.objects.create(note=self.note, user=self.reader, text='Nice')
+        Bookmark.objects.create(note=self.note, user=self.reader)
+        self.reader.delete()  # takes the comment and bookmark with it
+        self.assertEqual(self.counts(), (1, 1, 0, 0))
+        self.author.delete()  # takes the note
+        self.assertEqual(Subject.objects.get(id=self.subject.id).note_count, 0)
+        self.assertEqual(Branch.objects.get(id=self.branch.id).note_count, 0)
+
+    def test_moving_a_note(self):
+        self.note.subject = self.other_subject
+        self.note.save()
+        self.assertEqual(self.counts()[:2], (0, 0))
+        self.assertEqual(Subject.objects.get(id=self.other_subject.id).note_count, 1)
+
+
+class HomeStatsTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('statist', password='pass')
+        cls.branch = Branch.objects.create(name='Production', icon='🏭')
+        cls.subject = Subject.objects.create(name='Machining', branch=cls.branch, icon='🔩')
+
+    def upload(self):
+        return Note.objects.create(title='Lathe', subject=self.subject, uploaded_by=self.author)
+
+    def test_snapshot_follows_committed_uploads(self):
+        self.assertEqual(stats.get_snapshot()['branch_note_counts'][self.branch.id], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            note = self.upload()
+        self.assertEqual(stats.get_snapshot()['branch_note_counts'][self.branch.id], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            note.delete()
+        self.assertEqual(stats.get_snapshot()['total_notes'], 0)
+
+    def test_rolled_back_upload_leaves_snapshot_alone(self):
+        before = stats.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.upload()
+                    raise DatabaseError('upload failed')
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(stats.get_snapshot(), before)
+
+
+class BlobGarbageCollectionTests(StudappTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def blob(self, content, age=0):
+        name = note_storage.save('notes.txt', ContentFile(content))
+        if age:
+            past = time.time() - age
+            os.utime(note_storage.path(name), (past, past))
+        return name
+
+    def collect(self):
+        call_command('dedupe_media', gc=True, stdout=StringIO())
+
+    def test_unreferenced_blobs_go_after_the_grace_period(self):
+        old = self.blob(b'orphaned long ago', age=2 * 60 * 60)
+        fresh = self.blob(b'just uploaded, note not committed yet')
+        self.collect()
+        self.assertFalse(note_storage.exists(old))
+        self.assertTrue(note_storage.exists(fresh))
+
+    def test_reusing_a_blob_restarts_its_grace_period(self):
+        name = self.blob(b'same bytes', age=2 * 60 * 60)
+        self.assertEqual(self.blob(b'same bytes'), name)  # a second upload of identical content
+        self.collect()
+        self.assertTrue(note_storage.exists(name))
+
+
+class FileDeliveryTests(StudappTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user('downloader', password='pass')
+        self.client.force_login(self.user)
+        subject = Subject.objects.create(name='Signals', icon='📶')
+        self.note = Note.objects.create(
+            title='Fourier', subject=subject, uploaded_by=self.user,
+            file=note_storage.save('fourier.txt', ContentFile(b'0123456789' * 10)),
+        )
+        self.empty = Note.objects.create(
+            title='Blank', subject=subject, uploaded_by=self.user,
+            file=note_storage.save('blank.txt', ContentFile(b'')),
+        )
+        self.counted = self.enterContext(mock.patch.object(download_counter, 'increment'))
+
+    def download(self, note=None, method='get', **headers):
+        response = getattr(self.client, method)(reverse('download', args=[(note or self.note).id]), **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_parse_range_header(self):
+        cases = [
+            (None, 100, None),
+            ('items=0-1', 100, None),
+            ('bytes=5-2', 100, None),
+            ('bytes=' + ','.join(['0-1'] * 17), 100, None),
+            ('bytes=0-9', 100, [(0, 9)]),
+            ('bytes=90-', 100, [(90, 99)]),
+            ('bytes=-10', 100, [(90, 99)]),
+            ('bytes=-500', 100, [(0, 99)]),
+            ('bytes=95-500', 100, [(95, 99)]),
+            ('bytes=0-1, 5-6', 100, [(0, 1), (5, 6)]),
+            ('bytes=200-', 100, []),
+            ('bytes=-5', 0, []),
+            ('bytes=0-0', 0, []),
+        ]
+        for header, size, expected in cases:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range_header(header, size), expected)
+
+    def test_if_range(self):
+        factory = RequestFactory()
+        etag, modified = '"abc"', 1_700_000_000
+        self.assertTrue(_if_range_matches(factory.get('/'), etag, modified))
+        self.assertTrue(_if_range_matches(factory.get('/', HTTP_IF_RANGE='"abc"'), etag, modified))
+        self.assertFalse(_if_range_matches(factory.get('/', HTTP_IF_RANGE='W/"abc"'), etag, modified))
+        self.assertTrue(_if_range_matches(factory.get('/', HTTP_IF_RANGE=http_date(modified)), etag, modified))
+        self.assertFalse(_if_range_matches(factory.get('/', HTTP_IF_RANGE=http_date(modified - 60)), etag, modified))
+
+    def test_full_download_is_counted(self):
+        response, body = self.download()
+        self.assertEqual((response.status_code, len(body)), (200, 100))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.counted.assert_called_once_with(self.note.id)
+
+    def test_head_is_not_counted(self):
+        response, _ = self.download(method='head')
+        self.assertEqual(response.status_code, 200)
+        self.counted.assert_not_called()
+
+    def test_single_range(self):
+        response, body = self.download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'0123456789')
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.counted.assert_not_called()  # a resumed transfer
+
+    def test_stale_if_range_sends_everything(self):
+        response, body = self.download(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, len(body)), (200, 100))
+
+    def test_multipart_ranges(self):
+        response, body = self.download(HTTP_RANGE='bytes=0-4,90-94')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertIn(b'Content-Range: bytes 0-4/100\r\n\r\n01234', body)
+        self.assertIn(b'Content-Range: bytes 90-94/100\r\n\r\n01234', body)
+        self.counted.assert_called_once()  # starts at byte 0
+
+    def test_not_modified(self):
+        response, _ = self.download(HTTP_IF_NONE_MATCH=file_etag(self.note))
+        self.assertEqual(response.status_code, 304)
+        self.counted.assert_not_called()
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.download(HTTP_RANGE='bytes=200-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */100'))
+        response, _ = self.download(self.empty, HTTP_RANGE='bytes=-10')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */0'))
+
+
+class TextPreviewTests(StudappTestCase):
+
+    def preview(self, data, offset=0, max_bytes=1024):
+        """The text shown and the "Load more" offset (None on the last page)."""
+        page = ''.join(_text_preview_chunks(BytesIO(data), len(data), offset, max_bytes, 100, '/more'))
+        more = re.search(r'\?offset=(\d+)', page)
+        return html.unescape(page[page.index('<pre>') + 5:page.index('</pre>')]), more and int(more[1])
+
+    def test_character_split_at_the_cap_moves_to_the_next_page(self):
+        data = 'abécd'.encode()
+        self.assertEqual(self.preview(data, max_bytes=3), ('ab', 2))
+        self.assertEqual(self.preview(data, 2, max_bytes=3), ('éc', 5))
+        self.assertEqual(self.preview(data, 5, max_bytes=3), ('d', None))
+
+    def test_truncated_last_character_ends_the_preview(self):
+        self.assertEqual(self.preview('abc€'.encode()[:-1]), ('abc\ufffd', None))
+        self.assertEqual(self.preview('abc€'.encode()[:-1], max_bytes=4), ('abc', 3))
+
+    def test_later_pages_skip_partial_characters_in_utf8_only(self):
+        self.assertEqual(self.preview('xéy'.encode(), 2), ('y', None))
+        latin1 = 'Price: £5 at 20°C'.encode('latin-1')
+        self.assertEqual(self.preview(latin1, 7), ('£5 at 20°C', None))
+
+
+class OffloadTests(StudappTestCase):
+    """FILE_DELIVERY_MODE responses, served the way the front end would by OffloadStandIn."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.user = User.objects.create_user('offloader', password='pass')
+        self.client.force_login(self.user)
+        subject = Subject.objects.create(name='Networks', icon='🌐')
+        self.note = Note.objects.create(
+            title='TCP', subject=subject, uploaded_by=self.user,
+            file=note_storage.save('tcp.txt', ContentFile(b'abcdefghij' * 10)),
+        )
+        self.url = reverse('download', args=[self.note.id])
+        self.enterContext(mock.patch.object(download_counter, 'increment'))
+        # Like the test client: a real WSGI request mustn't close the test's connection
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def serve(self, **headers):
+        """Run a download through Django wrapped in the stand-in; returns (status, headers, body)."""
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        environ = RequestFactory().get(self.url, HTTP_COOKIE=cookie, **headers).environ
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started.update(status=status, headers=dict(response_headers))
+
+        body = b''.join(OffloadStandIn(get_wsgi_application())(environ, start_response))
+        return started['status'], started['headers'], body
+
+    @override_settings(FILE_DELIVERY_MODE='X-Accel-Redirect')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.note.file.name}')
+        self.assertEqual(response.content, b'')
+
+        status, headers, body = self.serve()
+        self.assertEqual((status, body), ('200 OK', b'abcdefghij' * 10))
+        self.assertIn('attachment', headers['Content-Disposition'])
+        self.assertNotIn('X-Accel-Redirect', headers)
+
+    @override_settings(FILE_DELIVERY_MODE='x-sendfile')
+    def test_x_sendfile_range(self):
+        self.assertEqual(self.client.get(self.url)['X-Sendfile'], self.note.file.path)
+        status, headers, body = self.serve(HTTP_RANGE='bytes=10-14')
+        self.assertEqual((status, body), ('206 Partial Content', b'abcde'))
+        self.assertEqual(headers['Content-Range'], 'bytes 10-14/100')
+        status, _, _ = self.serve(HTTP_RANGE='bytes=500-')
+        self.assertEqual(status, '416 Range Not Satisfiable')
+
+    def test_stand_in_stays_inside_media_root(self):
+        stand_in = OffloadStandIn(None)
+        self.assertIsNone(stand_in.resolve({'x-accel-redirect': '/protected-media/../settings.py'}))
+        self.assertIsNone(stand_in.resolve({'x-accel-redirect': '/elsewhere/tcp.txt'}))
+        self.assertEqual(
+            stand_in.resolve({'x-accel-redirect': f'/protected-media/{self.note.file.name}'}),
+            os.path.realpath(self.note.file.path),
+        )
+
+    def test_unknown_mode_is_rejected(self):
+        with override_settings(FILE_DELIVERY_MODE='x-accel'):
+            with self.assertRaises(ImproperlyConfigured):
+                delivery_mode()
+        with override_settings(FILE_DELIVERY_MODE=None):
+            self.assertIsNone(delivery_mode())
+
+
+class JobQueueTests(StudappTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.enterContext(mock.patch.dict(jobs.TASKS, {
+            'record': lambda **payload: self.calls.append(payload),
+            'explode': mock.Mock(side_effect=RuntimeError('boom')),
+        }))
+
+    def test_enqueue_is_idempotent(self):
+        first = jobs.enqueue('record', {'n': 1})
+        self.assertEqual(jobs.enqueue('record', {'n': 1}).id, first.id)
+        self.assertNotEqual(jobs.enqueue('record', {'n': 2}).id, first.id)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_claim_takes_each_job_once(self):
+        queued = jobs.enqueue('record', {'n': 1})
+        job = jobs.claim('worker-a')
+        self.assertEqual((job.id, job.status, job.attempts, job.locked_by), (queued.id, Job.RUNNING, 1, 'worker-a'))
+        self.assertIsNone(jobs.claim('worker-b'))
+        self.assertTrue(jobs.run_job(job))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.DONE)
+
+    def test_failures_back_off_then_fail(self):
+        jobs.enqueue('explode', max_attempts=2)
+        with self.assertLogs('studapp.jobs', 'WARNING'):
+            self.assertFalse(jobs.run_job(jobs.claim('worker')))
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertIsNone(jobs.claim('worker'))  # not due yet
+
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('studapp.jobs', 'WARNING'):
+            jobs.run_job(jobs.claim('worker'))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_backoff_grows_and_is_capped(self):
+        self.assertLess(jobs.backoff(1).total_seconds(), jobs.backoff(4).total_seconds())
+        self.assertLessEqual(jobs.backoff(50).total_seconds(), jobs.BACKOFF_MAX * 1.2)
+
+    def test_stale_locks_are_recovered_until_attempts_run_out(self):
+        expired = timezone.now() - jobs.STALE_LOCK_AFTER * 2
+        retry = jobs.enqueue('record', {'n': 1}, max_attempts=3)
+        spent = jobs.enqueue('record', {'n': 2}, max_attempts=3)
+        Job.objects.filter(id=retry.id).update(status=Job.RUNNING, attempts=1, locked_by='dead', locked_at=expired)
+        Job.objects.filter(id=spent.id).update(status=Job.RUNNING, attempts=3, locked_by='dead', locked_at=expired)
+
+        job = jobs.claim('worker')
+        self.assertEqual((job.id, job.attempts), (retry.id, 2))
+        spent.refresh_from_db()
+        self.assertEqual((spent.status, spent.locked_by), (Job.FAILED, ''))
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_long_running_jobs_keep_their_lock(self):
+        jobs.enqueue('record', {'n': 1})
+        job = jobs.claim('worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - jobs.STALE_LOCK_AFTER * 2)
+        self.assertTrue(jobs.heartbeat(job))
+        self.assertIsNone(jobs.claim('other'))  # fresh again, so not taken for a dead worker's
+        self.assertFalse(jobs.heartbeat(Job(id=job.id, locked_by='other')))
+
+        # The worker beats while the task runs (here: until the first beat arrives)
+        beat = threading.Event()
+        self.enterContext(mock.patch.object(jobs, 'HEARTBEAT_INTERVAL', timedelta(milliseconds=10)))
+        self.enterContext(mock.patch.object(jobs, 'heartbeat', side_effect=lambda job: beat.set()))
+        jobs.TASKS['record'] = lambda **payload: self.calls.append(beat.wait(5))
+        self.assertTrue(jobs.run_job(job))
+        self.assertEqual(self.calls, [True])
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=4)
+class UploadTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('uploader', password='pass')
+        branch = Branch.objects.create(name='Chemical', icon='⚗️')
+        cls.subject = Subject.objects.create(name='Thermodynamics', branch=branch, icon='🔥')
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        response = self.client.post(reverse('start_upload'), {
+            'title': 'Entropy', 'branch': self.subject.branch_id, 'subject': self.subject.id, 'filename': 'entropy.txt', 'size': 10,
+        })
+        self.assertEqual(response.status_code, 201)
+        self.session = UploadSession.objects.get(id=response.json()['id'])
+        self.url = response.json()['url']
+
+    def put(self, offset, data):
+        return self.client.put(f'{self.url}?offset={offset}', data, content_type='application/octet-stream')
+
+    def finish(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('finish_upload', args=[self.session.id]), data)
+
+    def test_resume_and_finish(self):
+        self.assertEqual(self.put(0, b'0123').json()['offset'], 4)
+        self.assertEqual(self.client.get(self.url).json()['offset'], 4)  # e.g. after a dropped connection
+        self.assertEqual(self.put(4, b'4567').json()['offset'], 8)
+        self.assertEqual(self.put(8, b'89').json()['offset'], 10)
+        response = self.finish(sha256=hashlib.sha256(b'0123456789').hexdigest())
+        self.assertEqual(response.status_code, 201)
+        note = Note.objects.get(id=response.json()['note'])
+        with note.file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertFalse(os.path.exists(uploads.part_path(self.session)))
+
+    def test_finish_twice_makes_one_note(self):
+        for offset in (0, 4, 8):
+            self.put(offset, b'0123456789'[offset:offset + 4])
+        UploadSession.objects.filter(id=self.session.id).update(writing_since=timezone.now())
+        self.assertEqual(self.finish().status_code, 409)  # another request is finishing it
+        self.assertTrue(os.path.exists(uploads.part_path(self.session)))
+
+        UploadSession.objects.filter(id=self.session.id).update(writing_since=None)
+        first = self.finish()
+        second = self.finish()  # e.g. a retry after a lost response
+        self.assertEqual((first.status_code, second.status_code), (201, 200))
+        self.assertEqual(second.json()['note'], first.json()['note'])
+        self.assertEqual(Note.objects.count(), 1)
+        self.assertEqual(self.put(10, b'x').status_code, 413)
+
+    def test_offset_mismatch_reports_the_resume_point(self):
+        self.put(0, b'0123')
+        for offset in (0, 6):  # a repeated chunk, then one that skips ahead
+            response = self.put(offset, b'4567')
+            self.assertEqual((response.status_code, response.json()['offset']), (409, 4))
+        self.assertEqual(self.put(0, b'0123456').status_code, 413)
+
+    def test_one_writer_per_session(self):
+        UploadSession.objects.filter(id=self.session.id).update(writing_since=timezone.now())
+        response = self.put(0, b'0123')
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 0))
+        self.assertFalse(os.path.exists(uploads.part_path(self.session)))
+
+        # A claim left behind by a request that died is taken over
+        expired = timezone.now() - uploads.CLAIM_TIMEOUT * 2
+        UploadSession.objects.filter(id=self.session.id).update(writing_since=expired)
+        self.assertEqual(self.put(0, b'0123').json()['offset'], 4)
+        self.session.refresh_from_db()
+        self.assertIsNone(self.session.writing_since)
+
+    def test_checksum_mismatch_discards_the_upload(self):
+        self.put(0, b'0123')
+        self.put(4, b'4567')
+        self.put(8, b'89')
+        response = self.finish(sha256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(b'0123456789').hexdigest())
+        self.assertFalse(Note.objects.exists())
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_finish_needs_every_byte(self):
+        self.put(0, b'0123')
+        response = self.finish()
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 4))
+
+    def test_purge_stale(self):
+        self.put(0, b'0123')
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        fresh = UploadSession.objects.create(
+            user=self.user, title='Enthalpy', subject=self.subject, filename='enthalpy.txt', size=1,
+        )
+        self.assertEqual(uploads.purge_stale(), 1)
+        self.assertEqual(list(UploadSession.objects.all()), [fresh])
+        self.assertFalse(os.path.exists(uploads.part_path(self.session)))
+
+
+class MetricsTests(StudappTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(METRICS_DIR=self.directory))
+
+    def write(self, filename, views):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump([['studapp_streamed_bytes_total', view, [sent]] for view, sent in views.items()], f)
+
+    def test_files_of_exited_processes_are_merged(self):
+        dead_pid = 2 ** 22 + 1  # above Linux's pid_max
+        self.write('merged.json', {'download': 100})
+        self.write(f'{dead_pid}-1.json', {'download': 10, 'preview': 5})
+        self.write(f'{os.getpid()}-2.json', {'download': 1})
+        expected = {('studapp_streamed_bytes_total', 'download'): [111], ('studapp_streamed_bytes_total', 'preview'): [5]}
+
+        self.assertEqual(dict(metrics.collect()), expected)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.endswith('.json')),
+            [f'{os.getpid()}-2.json', 'merged.json'],
+        )
+        self.assertEqual(dict(metrics.collect()), expected)  # merged once, not again
+
+    def test_server_timing_only_for_an_already_loaded_staff_user(self):
+        middleware = RequestMetricsMiddleware(lambda request: HttpResponse('ok'))
+        staff = User(username='admin', is_staff=True)
+
+        request = RequestFactory().get('/')
+        request.user = SimpleLazyObject(mock.Mock(side_effect=AssertionError('user was loaded')))
+        self.assertNotIn('Server-Timing', middleware(request))
+
+        request = RequestFactory().get('/')
+        request._cached_user = request.user = staff
+        self.assertIn('total;dur=', middleware(request)['Server-Timing'])
+
+    def test_endpoint_is_staff_or_token_only_by_default(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 403)  # e.g. via a proxy
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.client.force_login(User.objects.create_user('admin', password='pass', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class PopulateSubjectsTests(StudappTestCase):
+
+    def populate(self, **options):
+        call_command('populate_subjects', bulk=True, stdout=StringIO(), **options)
+
+    def test_failed_clear_and_refill_keeps_the_old_catalog(self):
+        Subject.objects.create(name='Legacy Subject', branch=Branch.objects.create(name='Legacy', icon='🏛️'))
+        with mock.patch.object(Subject.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.populate(clear=True)
+        self.assertTrue(Subject.objects.filter(name='Legacy Subject').exists())
+
+        self.populate(clear=True)
+        self.assertFalse(Branch.objects.filter(name='Legacy').exists())
+        self.assertTrue(Subject.objects.filter(name='Data Structures').exists())
+
+
+@skipUnless(renditions.Image, 'needs Pillow')
+class RenditionTests(StudappTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('illustrator', password='pass')
+        branch = Branch.objects.create(name='Architecture', icon='🏛️')
+        cls.subject = Subject.objects.create(name='Drawing', branch=branch, icon='✏️')
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        image = BytesIO()
+        renditions.Image.new('RGB', (1600, 800), 'teal').save(image, 'PNG')
+        self.name = note_storage.save('plan.png', ContentFile(image.getvalue()))
+
+    def note(self, title='Floor plan'):
+        with self.captureOnCommitCallbacks(execute=True):
+            note = Note.objects.create(title=title, subject=self.subject, uploaded_by=self.user, file=self.name)
+            enqueue_post_upload(note)
+        return note
+
+    def test_generate_then_url(self):
+        note = self.note()
+        self.assertIsNone(renditions.rendition_url(note, renditions.THUMBNAIL_WIDTH))
+        self.assertEqual(renditions.generate(self.name), len(renditions.WIDTHS))
+        self.assertEqual(renditions.generate(self.name), 0)  # already there
+        url = renditions.rendition_url(note, renditions.THUMBNAIL_WIDTH)
+        self.assertIn(f'renditions/{renditions.identity(self.name)}/w320.', url)
+        with renditions.Image.open(default_storage.path(renditions.rendition_name(self.name, 320))) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 160))
+
+    def test_listings_fall_back_without_queueing(self):
+        self.note()
+        Job.objects.all().delete()
+        response = self.client.get(reverse('browse'))
+        self.assertContains(response, 'Floor plan')
+        self.assertFalse(Job.objects.exists())
+
+    def test_scheduled_once_per_file(self):
+        first, second = self.note(), self.note('Floor plan (copy)')
+        job = Job.objects.get()
+        self.assertEqual((job.key, job.payload), (renditions.job_key(self.name), {'file': self.name}))
+        # The note that queued it going away doesn't stop the others getting renditions
+        first.delete()
+        self.assertTrue(jobs.run_job(jobs.claim('worker')))
+        self.assertIsNotNone(renditions.rendition_url(second, renditions.PREVIEW_WIDTH))
+
+    def test_collected_with_their_file(self):
+        self.note().delete()
+        renditions.generate(self.name)
+        call_command('dedupe_media', gc=True, grace=0, stdout=StringIO())
+        self.assertFalse(os.path.exists(default_storage.path(f'renditions/{renditions.identity(self.name)}')))
+        self.assertFalse(Job.objects.exists())  # so a re-upload is rendered again
+
+
+def locked_once(prefix, attempts):
+    """Execute wrapper: the first statement starting with `prefix` fails as if the database were locked."""
+    def wrapper(execute, sql, params, many, context):
+        if sql.startswith(prefix):
+            attempts.append(sql)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+# Committed rows, so the real read-only alias (a second connection) can see them
+@override_settings(CACHES=LOCMEM_CACHES)
+class DatabaseProfileTests(TransactionTestCase):
+    databases = {'default', 'readonly'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_read_only_views_read_through_the_read_alias(self):
+        user = User.objects.create_user('reader', password='pass')
+        subject = Subject.objects.create(name='Optics', branch=Branch.objects.create(name='Physics', icon='🔭'))
+        Note.objects.create(title='Snell', subject=subject, uploaded_by=user)
+        reads, writes = CaptureQueriesContext(connections['readonly']), CaptureQueriesContext(connection)
+        with reads, writes:
+            response = self.client.get(reverse('notes_api'))
+        self.assertEqual([note['title'] for note in response.json()['notes']], ['Snell'])
+        self.assertTrue(any('"studapp_note"' in query['sql'] for query in reads.captured_queries))
+        self.assertFalse(any('"studapp_note"' in query['sql'] for query in writes.captured_queries))
+        self.assertNotIn(retry_on_busy, connections['readonly'].execute_wrappers)
+
+    def test_busy_statements_are_retried_only_where_safe(self):
+        sleep = self.enterContext(mock.patch('studapp.dbprofile.time.sleep'))
+        self.assertIn(retry_on_busy, connection.execute_wrappers)
+        attempts = []
+        with self.assertLogs('studapp.dbprofile', 'WARNING'), connection.execute_wrapper(locked_once('INSERT', attempts)):
+            Branch.objects.create(name='Retried', icon='🔁')  # autocommit
+        self.assertEqual(len(attempts), 2)
+        self.assertTrue(Branch.objects.filter(name='Retried').exists())
+
+        attempts, begins = [], []
+        with connection.execute_wrapper(locked_once('INSERT', attempts)), connection.execute_wrapper(locked_once('BEGIN', begins)):
+            with self.assertLogs('studapp.dbprofile', 'WARNING'), self.assertRaises(OperationalError):
+                with transaction.atomic():
+                    Branch.objects.create(name='Not retried', icon='🔁')
+        self.assertEqual((len(begins), len(attempts)), (2, 1))  # BEGIN again, not the INSERT mid-transaction
+        self.assertFalse(Branch.objects.filter(name='Not retried').exists())
+        self.assertEqual(sleep.call_count, 2)
@@ -0,0 +1,192 @@
+"""Chunked, resumable uploads.
+
+The client opens an UploadSession, PUTs the file in chunks at increasing
+offsets and then finalizes it. Chunks are appended to a part file in
+`blobs/incoming/`, on the same filesystem as the blobs, so finalizing is a
+rename into the content-addressed name (see studapp.storage). After an
+interruption the client asks for the session's offset and carries on
+from there. Each PUT claims the session before touching the part file, so
+a duplicated request is turned away with the offset instead of racing.
+Finishing claims it the same way, and a finished session keeps its note
+(until purge_stale) so that a repeated finish gets that note back.
+
+The SHA-256 is computed as chunks arrive. Hash state can't be stored in
+the database, so it lives in this process; if a chunk lands on another
+worker (or after a restart) the prefix already on disk is re-hashed once.
+"""
+import hashlib
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import UploadSession
+from .storage import BLOB_DIR, CHUNK_SIZE, blob_name, file_sha256, note_storage
+
+_hashers = {}  # session id -> (offset hashed up to, sha256 object)
+_lock = threading.Lock()
+
+# A chunk is at most UPLOAD_CHUNK_SIZE, so a claim held this long is from a dead request
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class OffsetMismatch(Exception):
+    """The chunk doesn't start where the session left off."""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected offset {expected}')
+        self.expected = expected
+
+
+class ChunkTooLarge(Exception):
+    """The chunk is over UPLOAD_CHUNK_SIZE or runs past the declared file size."""
+
+
+class AlreadyFinishing(Exception):
+    """Another request holds the session (e.g. a concurrent finish)."""
+
+
+def max_chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def part_path(session):
+    return note_storage.path(f'{BLOB_DIR}/incoming/{session.id}.part')
+
+
+def _hasher_at(session, offset):
+    """A sha256 object covering the first `offset` bytes of the part file."""
+    with _lock:
+        cached = _hashers.pop(session.id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(part_path(session), 'rb') as f:
+        remaining = offset
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def _unclaimed(now):
+    return Q(writing_since__isnull=True) | Q(writing_since__lt=now - CLAIM_TIMEOUT)
+
+
+def _claim(session, offset):
+    """Take the session for one chunk at `offset`; returns the claim's timestamp.
+
+    The conditional UPDATE lets exactly one request through, so a retried or
+    duplicated PUT can't write the part file (or feed the digest) alongside
+    the first. A claim older than CLAIM_TIMEOUT is from a request that died
+    and may be taken over.
+    """
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(
+        _unclaimed(now), id=session.id, received=offset, note__isnull=True,
+    ).update(writing_since=now, updated_at=now)
+    if not claimed:
+        session.refresh_from_db(fields=['received'])
+        raise OffsetMismatch(session.received)
+    return now
+
+
+def write_chunk(session, offset, stream, length):
+    """Append `length` bytes from `stream` at `offset`. Returns the new offset."""
+    if length > max_chunk_size() or offset + length > session.size:
+        raise ChunkTooLarge()
+    claim = _claim(session, offset)
+    held = UploadSession.objects.filter(id=session.id, writing_since=claim)
+    new_offset = offset
+    try:
+        path = part_path(session)
+        if offset and not os.path.exists(path):
+            # Part file lost (e.g. purged): start the upload over
+            new_offset = session.received = 0
+            raise OffsetMismatch(0)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = _hasher_at(session, offset) if offset else hashlib.sha256()
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # Drop anything past the acknowledged offset from an interrupted chunk
+            f.seek(offset)
+            f.truncate()
+            while new_offset < offset + length:
+                data = stream.read(min(CHUNK_SIZE, offset + length - new_offset))
+                if not data:
+                    break
+                f.write(data)
+                digest.update(data)
+                new_offset += len(data)
+    finally:
+        # Only while the claim is still ours: a request that outlived it mustn't move the offset
+        moved = held.update(received=new_offset, writing_since=None, updated_at=timezone.now())
+
+    if not moved:
+        session.refresh_from_db(fields=['received'])
+        raise OffsetMismatch(session.received)
+    session.received = new_offset
+    with _lock:
+        _hashers[session.id] = (new_offset, digest)
+    return new_offset
+
+
+def finalize(session):
+    """Claim the completed session and move its part file into its blob.
+
+    Returns (blob name, sha256 hex); raises AlreadyFinishing if another
+    request got the claim first. The caller records the note with finished().
+    """
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(
+        _unclaimed(now), id=session.id, received=session.size, note__isnull=True,
+    ).update(writing_since=now, updated_at=now)
+    if not claimed:
+        raise AlreadyFinishing()
+    with _lock:
+        cached = _hashers.pop(session.id, None)
+    path = part_path(session)
+    if cached and cached[0] == session.size:
+        digest = cached[1].hexdigest()
+    else:
+        with open(path, 'rb') as f:
+            digest = file_sha256(f)
+    name = blob_name(digest, session.filename)
+    if not note_storage.commit_blob(path, name):
+        os.remove(path)  # identical content is already stored
+    return name, digest
+
+
+def finished(session, note):
+    """Record the note `session` became and release the claim."""
+    session.note = note
+    session.writing_since = None
+    session.save(update_fields=['note', 'writing_since', 'updated_at'])
+
+
+def discard(session):
+    """Delete a session and its part file."""
+    with _lock:
+        _hashers.pop(session.id, None)
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+def purge_stale(max_age=None):
+    """Discard sessions untouched for `max_age` (default UPLOAD_SESSION_TTL_HOURS). Returns how many."""
+    if max_age is None:
+        max_age = timedelta(hours=getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for session in stale:
+        discard(session)
+        count += 1
+    return count
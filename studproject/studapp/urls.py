@@ -8,12 +8,22 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('browse/', views.browse_notes, name='browse'),
     path('upload/', views.upload_note, name='upload'),
+    path('api/uploads/', views.start_upload, name='start_upload'),
+    path('api/uploads/<uuid:session_id>/', views.upload_session, name='upload_session'),
+    path('api/uploads/<uuid:session_id>/finish/', views.finish_upload, name='finish_upload'),
     path('download/<int:note_id>/', views.download_note, name='download'),
     path('preview/<int:note_id>/', views.preview_note, name='preview'),
+    path('preview/<int:note_id>/file/', views.preview_file, name='preview_file'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('api/dashboard/notes/', views.dashboard_notes, name='dashboard_notes'),
+    path('api/dashboard/bookmarks/', views.dashboard_bookmarks, name='dashboard_bookmarks'),
     path('bookmark/<int:note_id>/', views.toggle_bookmark, name='toggle_bookmark'),
     path('delete/<int:note_id>/', views.delete_note, name='delete_note'),
     path('api/subjects/<int:branch_id>/', views.get_subjects, name='get_subjects'),
+    path('api/notes/', views.notes_api, name='notes_api'),
+    path('api/notes/<int:note_id>/comments/', views.note_comments, name='note_comments'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
     path('comment/<int:note_id>/', views.add_comment, name='add_comment'),
     path('comment/delete/<int:comment_id>/', views.delete_comment, name='delete_comment'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,38 +1,58 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import hashlib
+import hmac
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.timesince import timesince
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import FileResponse, JsonResponse, HttpResponse
-from django.db.models import Q, Count
+from django.http import JsonResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
 from django.core.paginator import Paginator
-from .models import Note, Subject, Branch, Bookmark, Comment
-from .forms import SignUpForm, NoteUploadForm, UserUpdateForm, CommentForm
-
-
-def home(request):
+from .models import Note, Subject, Bookmark, Comment, Job, UploadSession
+from .forms import SignUpForm, NoteUploadForm, UploadInitForm, UserUpdateForm, CommentForm
+from .search import match_notes, search_notes, snippet_html
+from .pagination import aapproximate_count, akeyset_page
+from .counters import download_counter
+from . import bookmarks, navigation, renditions, stats, uploads
+from .delivery import serve_note_file, stream_text_preview
+from .tasks import enqueue_post_upload
+from .routers import read_only_view
+from .metrics import render_prometheus
+
+
+async def arender(request, template_name, context):
+    """`render` for async views. Runs in a worker thread because templates
+    read lazy, sync-only state such as `request.user`."""
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@read_only_view
+async def home(request):
     """Home page."""
-    recent_notes = Note.objects.select_related('subject', 'subject__branch', 'uploaded_by')[:6]
-    branches = Branch.objects.annotate(note_count=Count('subjects__notes'))
-
-    # Get IDs for the four featured FE subjects
-    featured_subjects = {}
-    subject_map = {
-        'math': 'Engineering Mathematics-I',
-        'mechanics': 'Engineering Mechanics',
-        'electrical': 'Basic Electrical Engineering',
-        'chemistry': 'Engineering Chemistry',
-    }
-    for key, name in subject_map.items():
-        subj = Subject.objects.filter(name=name).first()
-        if subj:
-            featured_subjects[key] = subj.id
-
-    return render(request, 'home.html', {
+    recent_notes = [
+        note async for note in Note.objects.select_related('subject', 'subject__branch', 'uploaded_by')[:6]
+    ]
+    snapshot = await sync_to_async(stats.get_snapshot)()
+    tree = await sync_to_async(navigation.get_tree)()
+    branches = [
+        dict(branch, note_count=snapshot['branch_note_counts'].get(branch['id'], 0))
+        for branch in tree
+    ]
+
+    return await arender(request, 'home.html', {
         'recent_notes': recent_notes,
         'branches': branches,
-        'total_notes': Note.objects.count(),
-        'total_branches': Branch.objects.count(),
-        'featured_subjects': featured_subjects,
+        'total_notes': snapshot['total_notes'],
+        'total_branches': snapshot['total_branches'],
+        'featured_subjects': snapshot['featured_subjects'],
     })
 
 
@@ -72,40 +92,35 @@ def logout_view(request):
     return redirect('home')
 
 
-def browse_notes(request):
+@read_only_view
+async def browse_notes(request):
     """Browse notes with optional filters and search."""
-    notes = Note.objects.select_related('subject', 'subject__branch', 'uploaded_by').prefetch_related('comments', 'comments__user').annotate(comment_count=Count('comments'))
-    branches = Branch.objects.annotate(note_count=Count('subjects__notes'))
-    subjects = Subject.objects.select_related('branch').annotate(note_count=Count('notes'))
-
     branch_id = request.GET.get('branch')
     subject_id = request.GET.get('subject')
     query = request.GET.get('q', '')
 
-    if branch_id:
-        notes = notes.filter(subject__branch_id=branch_id)
-        subjects = subjects.filter(branch_id=branch_id)
-    if subject_id:
-        notes = notes.filter(subject_id=subject_id)
-    if query:
-        notes = notes.filter(
-            Q(title__icontains=query) | Q(description__icontains=query) |
-            Q(subject__name__icontains=query) | Q(subject__branch__name__icontains=query)
-        )
+    notes = filtered_notes = _filter_notes(Note.objects.all(), branch_id, subject_id)
 
-    # Pagination — 12 per page
-    page_obj = Paginator(notes, 12).get_page(request.GET.get('page'))
+    notes = notes.select_related('subject', 'subject__branch', 'uploaded_by')
+
+    # Pagination — 12 per page. Relevance-ranked search results and old
+    # ?page= links use numbered pages; the plain listing pages by cursor.
+    if query or request.GET.get('page'):
+        page_obj = await sync_to_async(_numbered_page)(notes, query, request.GET.get('page'))
+    else:
+        total = await aapproximate_count(filtered_notes, f'browse:{branch_id}:{subject_id}')
+        page_obj = await akeyset_page(notes, request.GET.get('after'), per_page=12, total=total)
+    await sync_to_async(_add_previews)(page_obj)
 
-    # Bookmarks for current user
-    bookmarked_ids = []
-    if request.user.is_authenticated:
-        bookmarked_ids = list(Bookmark.objects.filter(user=request.user).values_list('note_id', flat=True))
+    # Which of this page's notes the user has bookmarked
+    bookmarked_ids = set()
+    user = await request.auser()
+    if user.is_authenticated:
+        bookmarked_ids = await sync_to_async(bookmarks.bookmarked_among)(user.id, [note.id for note in page_obj])
 
-    return render(request, 'browse.html', {
+    return await arender(request, 'browse.html', {
         'notes': page_obj,
         'page_obj': page_obj,
-        'branches': branches,
-        'subjects': subjects,
         'current_branch': branch_id,
         'current_subject': subject_id,
         'search_query': query,
@@ -113,10 +128,180 @@ def browse_notes(request):
     })
 
 
-def get_subjects(request, branch_id):
+def _filter_notes(notes, branch_id, subject_id):
+    """The branch and subject filters of browse_notes and notes_api."""
+    if branch_id:
+        # EXISTS rather than a join keeps SQLite walking the (-created_at, id)
+        # index in order; a join would fetch the whole branch and sort it
+        notes = notes.filter(Exists(Subject.objects.filter(id=OuterRef('subject_id'), branch_id=branch_id)))
+    if subject_id:
+        notes = notes.filter(subject_id=subject_id)
+    return notes
+
+
+def _numbered_page(notes, query, number):
+    """One page of search results or of the listing by ?page=, fully loaded."""
+    if query:
+        # The branch/subject filters narrow the set; the search index ranks it
+        notes = search_notes(notes, query)
+    else:
+        notes = notes.order_by('-created_at', 'id')
+    page_obj = Paginator(notes, 12).get_page(number)
+    page_obj.object_list = list(page_obj.object_list)
+    return page_obj
+
+
+def _add_previews(page_obj):
+    for note in page_obj:
+        note.thumbnail_url = renditions.rendition_url(note, renditions.THUMBNAIL_WIDTH)
+        # Where the query matched inside the file, if it did
+        note.snippet_page, note.snippet = snippet_html(getattr(note, 'search_snippet', None))
+
+
+@read_only_view
+async def get_subjects(request, branch_id):
     """Return subjects for a branch (JSON, used by upload form)."""
     subjects = Subject.objects.filter(branch_id=branch_id).values('id', 'name', 'icon')
-    return JsonResponse(list(subjects), safe=False)
+    return JsonResponse([subject async for subject in subjects], safe=False)
+
+
+@read_only_view
+async def note_comments(request, note_id):
+    """Return one page of a note's comments (JSON, loaded by the note modal)."""
+    note = await aget_object_or_404(Note, id=note_id)
+    comments = Comment.objects.filter(note=note).select_related('user')
+    page = await akeyset_page(comments, request.GET.get('after'), per_page=20)
+    user = await request.auser()
+    return JsonResponse({
+        'comments': [_comment_json(comment, user) for comment in page],
+        'next': page.next_cursor,
+    })
+
+
+def _comment_json(comment, user):
+    return {
+        'id': comment.id,
+        'author': comment.user.first_name or comment.user.username,
+        'text': comment.text,
+        'time': f'{timesince(comment.created_at)} ago',
+        'delete_url': reverse('delete_comment', args=[comment.id]) if comment.user_id == user.id else None,
+    }
+
+
+# --------------- Notes API ---------------
+
+# ?fields= name -> .values() lookup
+NOTE_API_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'subject_id': 'subject_id',
+    'subject': 'subject__name',
+    'branch_id': 'subject__branch_id',
+    'branch': 'subject__branch__name',
+    'uploader': 'uploaded_by__username',
+    'filename': 'original_filename',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'downloads': 'downloads',
+    'comments': 'comment_count',
+    'bookmarks': 'bookmark_count',
+}
+NOTE_API_URL_FIELDS = {'download_url': 'download', 'preview_url': 'preview'}
+NOTE_API_DEFAULT_FIELDS = ('id', 'title', 'subject', 'branch', 'created_at')
+# Counters are bumped with update(), which leaves updated_at alone
+NOTE_API_COUNTER_FIELDS = ('downloads', 'comments', 'bookmarks')
+NOTE_API_PAGE_SIZE = 20
+NOTE_API_MAX_PAGE_SIZE = 100
+
+
+@read_only_view
+async def notes_api(request):
+    """Note listing as JSON, newest first.
+
+    Takes browse's ?branch=, ?subject= and ?q= filters, plus ?fields= (comma
+    separated, see NOTE_API_FIELDS), ?limit= and the ?after= cursor from
+    `next`. Rows come straight from .values(). A weak ETag lets clients
+    revalidate a page with If-None-Match and get a 304.
+    """
+    fields = [name for name in request.GET.get('fields', '').split(',') if name] or list(NOTE_API_DEFAULT_FIELDS)
+    unknown = [name for name in fields if name not in NOTE_API_FIELDS and name not in NOTE_API_URL_FIELDS]
+    if unknown:
+        return JsonResponse({
+            'error': f'Unknown field(s): {", ".join(unknown)}',
+            'fields': [*NOTE_API_FIELDS, *NOTE_API_URL_FIELDS],
+        }, status=400)
+    try:
+        branch_id = int(request.GET['branch']) if request.GET.get('branch') else None
+        subject_id = int(request.GET['subject']) if request.GET.get('subject') else None
+        limit = min(max(int(request.GET.get('limit', NOTE_API_PAGE_SIZE)), 1), NOTE_API_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'branch, subject and limit must be integers.'}, status=400)
+
+    notes = _filter_notes(Note.objects.all(), branch_id, subject_id)
+    lookups = {'id', 'created_at', 'updated_at'}
+    lookups.update(NOTE_API_FIELDS[name] for name in fields if name in NOTE_API_FIELDS)
+    if 'filename' in fields:
+        lookups.add('file')  # fallback when there's no original name
+    query = request.GET.get('q', '')
+    if query:
+        # A filter here, not a ranking, so the cursor order stays newest first
+        notes = match_notes(notes, query)
+    page = await akeyset_page(notes.values(*lookups), request.GET.get('after'), per_page=limit)
+
+    etag = _listing_etag(page.object_list, fields, page.next_cursor)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    response = JsonResponse({
+        'notes': [_serialize_note(row, fields) for row in page],
+        'next': page.next_cursor,
+    })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # keep it, but revalidate before use
+    return response
+
+
+def _serialize_note(row, fields):
+    data = {}
+    for name in fields:
+        if name in NOTE_API_URL_FIELDS:
+            data[name] = reverse(NOTE_API_URL_FIELDS[name], args=[row['id']])
+        elif name == 'filename':
+            data[name] = row['original_filename'] or row['file'].split('/')[-1]
+        else:
+            data[name] = row[NOTE_API_FIELDS[name]]
+    return data
+
+
+def _listing_etag(rows, fields, next_cursor):
+    """Weak ETag from the newest updated_at on the page, the rows on it and the fields asked for."""
+    latest = max((row['updated_at'] for row in rows), default=None)
+    parts = [latest.isoformat() if latest else '', ','.join(fields), next_cursor or '']
+    parts.extend(str(row['id']) for row in rows)
+    counters = [NOTE_API_FIELDS[name] for name in fields if name in NOTE_API_COUNTER_FIELDS]
+    parts.extend(str(row[lookup]) for row in rows for lookup in counters)
+    return 'W/' + quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+@login_required(login_url='login')
+def job_status(request, job_id):
+    """Status of a background job (JSON, staff only)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    job = get_object_or_404(Job, id=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'task': job.task,
+        'key': job.key,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_after': job.run_after.isoformat(),
+        'last_error': job.last_error.strip().splitlines()[-1] if job.last_error else None,
+        'updated_at': job.updated_at.isoformat(),
+    })
 
 
 @login_required(login_url='login')
@@ -127,61 +312,175 @@ def upload_note(request):
         if form.is_valid():
             note = form.save(commit=False)
             note.uploaded_by = request.user
-            note.save()
+            note.original_filename = note.file.name.split('/')[-1]
+            _publish_note(note)
             messages.success(request, 'Note uploaded!')
             return redirect('browse')
     else:
         form = NoteUploadForm()
-    return render(request, 'upload.html', {'form': form})
+    return render(request, 'upload.html', {'form': form, 'chunk_size': uploads.max_chunk_size()})
+
+
+def _publish_note(note):
+    """Save a new note and do the bookkeeping every upload path shares."""
+    with transaction.atomic():
+        note.save()  # the subject and branch counts follow via signals
+        # Thumbnails etc. run in the job worker, not in this request
+        enqueue_post_upload(note)
+
+
+# --------------- Chunked uploads ---------------
+
+def _upload_state(session):
+    return {
+        'id': str(session.id),
+        'offset': session.received,
+        'size': session.size,
+        'chunk_size': uploads.max_chunk_size(),
+        'url': reverse('upload_session', args=[session.id]),
+    }
+
+
+@login_required(login_url='login')
+def start_upload(request):
+    """Open a chunked upload session (POST note details + filename + size)."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    form = UploadInitForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+    data = form.cleaned_data
+    session = UploadSession.objects.create(
+        user=request.user,
+        title=data['title'],
+        description=data['description'],
+        subject=data['subject'],
+        filename=data['filename'],
+        size=data['size'],
+    )
+    return JsonResponse(_upload_state(session), status=201)
+
+
+@login_required(login_url='login')
+def upload_session(request, session_id):
+    """GET the resume offset, PUT a chunk at `?offset=`, or DELETE to cancel."""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_upload_state(session))
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return JsonResponse({'cancelled': True})
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        offset = int(request.GET['offset'])
+        length = int(request.META['CONTENT_LENGTH'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'offset and Content-Length are required'}, status=400)
+    try:
+        uploads.write_chunk(session, offset, request, length)
+    except uploads.OffsetMismatch as exc:
+        # Client is out of step (e.g. a lost response); tell it where to resume
+        return JsonResponse({'error': 'Offset mismatch', 'offset': exc.expected}, status=409)
+    except uploads.ChunkTooLarge:
+        return JsonResponse({'error': 'Chunk too large', 'chunk_size': uploads.max_chunk_size()}, status=413)
+    return JsonResponse(_upload_state(session))
+
+
+@login_required(login_url='login')
+def finish_upload(request, session_id):
+    """Turn a fully received session into a Note, as upload_note would."""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if session.note_id:
+        # A repeat (e.g. the first response was lost): the note already exists
+        return JsonResponse({'note': session.note_id, 'redirect': reverse('browse')})
+    if session.received != session.size:
+        return JsonResponse({'error': 'Upload incomplete', 'offset': session.received}, status=409)
+
+    try:
+        name, digest = uploads.finalize(session)
+    except uploads.AlreadyFinishing:
+        return JsonResponse({'error': 'Upload is already being finished'}, status=409)
+    expected = request.POST.get('sha256')
+    note = Note(
+        title=session.title,
+        description=session.description,
+        subject=session.subject,
+        uploaded_by=request.user,
+        original_filename=session.filename,
+    )
+    note.file.name = name
+    if expected and expected.lower() != digest:
+        session.delete()  # the blob is left for dedupe_media --gc (see studapp.storage)
+        return JsonResponse({'error': 'Checksum mismatch', 'sha256': digest}, status=400)
+    with transaction.atomic():
+        _publish_note(note)
+        uploads.finished(session, note)
+    messages.success(request, 'Note uploaded!')
+    return JsonResponse({'note': note.id, 'redirect': reverse('browse')}, status=201)
 
 
 @login_required(login_url='login')
-def download_note(request, note_id):
+async def download_note(request, note_id):
     """Download a note and count it."""
-    note = get_object_or_404(Note, id=note_id)
+    note = await aget_object_or_404(Note, id=note_id)
     if not note.file:
         messages.error(request, 'No file attached to this note.')
         return redirect('browse')
     try:
-        filename = note.file.name.split('/')[-1]
-        response = FileResponse(note.file.open('rb'), as_attachment=True, filename=filename)
-        note.downloads += 1
-        note.save(update_fields=['downloads'])
-        return response
+        response = await sync_to_async(serve_note_file, thread_sensitive=False)(request, note, as_attachment=True)
     except FileNotFoundError:
         messages.error(request, 'File not found on server.')
         return redirect('browse')
+    # Resumed ranges and 304 revalidations aren't new downloads
+    if response.is_new_download:
+        await sync_to_async(download_counter.increment)(note.id)
+    return response
 
 
-def preview_note(request, note_id):
+async def preview_file(request, note_id):
+    """Serve a note's raw file inline (images and PDFs in the preview)."""
+    note = await aget_object_or_404(Note, id=note_id)
+    if not note.file:
+        messages.error(request, 'No file attached.')
+        return redirect('browse')
+    try:
+        return await sync_to_async(serve_note_file, thread_sensitive=False)(request, note)
+    except FileNotFoundError:
+        messages.error(request, 'File not found.')
+        return redirect('browse')
+
+
+async def preview_note(request, note_id):
     """Preview a note file in the browser."""
-    note = get_object_or_404(Note, id=note_id)
+    note = await aget_object_or_404(Note, id=note_id)
     if not note.file:
         messages.error(request, 'No file attached.')
         return redirect('browse')
 
     ext = note.file.name.rsplit('.', 1)[-1].lower()
-    url = note.file.url
+    url = reverse('preview_file', args=[note.id])
 
-    # Images — show centered
+    # Images — show centered, downscaled when a rendition is ready
     if ext in ('jpg', 'jpeg', 'png', 'gif', 'webp'):
+        url = await sync_to_async(renditions.rendition_url)(note, renditions.PREVIEW_WIDTH) or url
         return HttpResponse(f'''
         <body style="margin:0;display:flex;justify-content:center;align-items:center;background:#0f172a;height:100vh" oncontextmenu="return false">
             <img src="{url}" style="max-width:100%;max-height:100%;object-fit:contain">
         </body>''')
 
-    # Text files — show as preformatted text
+    # Text files — streamed a page at a time, escaped as they go
     if ext in ('txt', 'py', 'js', 'html', 'css'):
         try:
-            content = note.file.read().decode('utf-8')
-            import html
-            content = html.escape(content)
-            return HttpResponse(f'''
-            <body style="margin:0;padding:20px;background:#0f172a;color:#f8fafc;font-family:monospace" oncontextmenu="return false">
-                <pre>{content}</pre>
-            </body>''')
-        except Exception:
-            pass
+            return await sync_to_async(stream_text_preview, thread_sensitive=False)(
+                request, note, reverse('preview', args=[note.id]),
+            )
+        except FileNotFoundError:
+            messages.error(request, 'File not found.')
+            return redirect('browse')
 
     # PDFs — embed in iframe
     if ext == 'pdf':
@@ -191,19 +490,16 @@ def preview_note(request, note_id):
         </body>''')
 
     # Fallback — serve the raw file
-    try:
-        return FileResponse(note.file.open('rb'), as_attachment=False)
-    except FileNotFoundError:
-        messages.error(request, 'File not found.')
-        return redirect('browse')
+    return await preview_file(request, note_id)
+
+
+DASHBOARD_PAGE_SIZE = 10
 
 
 @login_required(login_url='login')
 def dashboard(request):
-    """User dashboard."""
-    user_notes = Note.objects.filter(uploaded_by=request.user).select_related('subject')
-    user_bookmarks = Bookmark.objects.filter(user=request.user).select_related('note', 'note__subject')
-
+    """User dashboard. The notes and bookmarks sections load a page at a time
+    from dashboard_notes and dashboard_bookmarks."""
     if request.method == 'POST' and 'update_profile' in request.POST:
         u_form = UserUpdateForm(request.POST, instance=request.user)
         if u_form.is_valid():
@@ -214,25 +510,78 @@ def dashboard(request):
         u_form = UserUpdateForm(instance=request.user)
 
     return render(request, 'dashboard.html', {
-        'user_notes': user_notes,
-        'user_bookmarks': user_bookmarks,
+        'summary': stats.get_user_summary(request.user.id),
         'u_form': u_form,
     })
 
 
 @login_required(login_url='login')
-def toggle_bookmark(request, note_id):
-    """Add or remove a bookmark."""
-    note = get_object_or_404(Note, id=note_id)
-    bookmark, created = Bookmark.objects.get_or_create(user=request.user, note=note)
-    if not created:
-        bookmark.delete()
+@read_only_view
+async def dashboard_notes(request):
+    """One page of the user's uploads (JSON with rendered cards, for the dashboard)."""
+    user = await request.auser()
+    notes = Note.objects.filter(uploaded_by=user).select_related('subject')
+    return await _dashboard_page(request, notes, 'dashboard_notes.html')
+
+
+@login_required(login_url='login')
+@read_only_view
+async def dashboard_bookmarks(request):
+    """One page of the user's bookmarks (JSON with rendered cards, for the dashboard)."""
+    user = await request.auser()
+    user_bookmarks = Bookmark.objects.filter(user=user).select_related('note__subject', 'note__uploaded_by')
+    return await _dashboard_page(request, user_bookmarks, 'dashboard_bookmarks.html')
+
+
+async def _dashboard_page(request, queryset, template_name):
+    page = await akeyset_page(queryset, request.GET.get('after'), per_page=DASHBOARD_PAGE_SIZE)
+    html = await sync_to_async(render_to_string)(template_name, {'page': page}, request)
+    return JsonResponse({'html': html, 'next': page.next_cursor})
+
+
+def _wants_json(request):
+    """True for fetch() calls from the page, which ask for JSON instead of a redirect."""
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+@login_required(login_url='login')
+async def toggle_bookmark(request, note_id):
+    """Add or remove a bookmark. Answers fetch() calls with the new state as JSON."""
+    note = await aget_object_or_404(Note.objects.only('id'), id=note_id)
+    user = await request.auser()
+    bookmarked = await sync_to_async(_toggle_bookmark)(user, note.id)
+    if _wants_json(request):
+        return JsonResponse({
+            'bookmarked': bookmarked,
+            'bookmark_count': await Note.objects.filter(id=note.id).values_list('bookmark_count', flat=True).aget(),
+            'user_bookmark_count': await sync_to_async(bookmarks.count)(user.id),
+        })
+    if not bookmarked:
         messages.info(request, 'Bookmark removed.')
     else:
         messages.success(request, 'Note bookmarked!')
     return redirect(request.META.get('HTTP_REFERER', 'browse'))
 
 
+def _toggle_bookmark(user, note_id):
+    """Returns True if the note is now bookmarked.
+
+    One write either way: delete the bookmark if it's there, otherwise
+    insert it. No read first, as get_or_create needed.
+    """
+    # Note.bookmark_count and the user's cached bookmarks follow via signals
+    with transaction.atomic():
+        deleted, _ = Bookmark.objects.filter(user=user, note_id=note_id).delete()
+        if deleted:
+            return False
+        try:
+            with transaction.atomic():
+                Bookmark.objects.create(user=user, note_id=note_id)
+        except IntegrityError:
+            pass  # a concurrent toggle inserted it first
+    return True
+
+
 @login_required(login_url='login')
 def delete_note(request, note_id):
     """Delete a note (only the uploader can delete)."""
@@ -241,37 +590,83 @@ def delete_note(request, note_id):
         messages.error(request, "You can only delete your own notes.")
         return redirect('dashboard')
     if request.method == 'POST':
-        if note.file:
-            import os
-            if os.path.isfile(note.file.path):
-                os.remove(note.file.path)
-        note.delete()
+        note.delete()  # counters for the note, its comments and bookmarks follow via signals
+        # Identical uploads share one blob; dedupe_media --gc removes it once
+        # no note uses it (not here, see studapp.storage)
         messages.success(request, 'Note deleted.')
     return redirect('dashboard')
 
 
 @login_required(login_url='login')
-def add_comment(request, note_id):
-    """Add a comment to a note."""
-    note = get_object_or_404(Note, id=note_id)
+async def add_comment(request, note_id):
+    """Add a comment to a note. Answers fetch() calls with the comment as JSON."""
+    note = await aget_object_or_404(Note.objects.only('id'), id=note_id)
+    wants_json = _wants_json(request)
     if request.method == 'POST':
         form = CommentForm(request.POST)
         if form.is_valid():
             comment = form.save(commit=False)
             comment.note = note
-            comment.user = request.user
-            comment.save()
+            comment.user = user = await request.auser()
+            await sync_to_async(_save_comment)(comment)
+            if wants_json:
+                return JsonResponse({
+                    'comment': _comment_json(comment, user),
+                    'comment_count': await _comment_count(note.id),
+                }, status=201)
             messages.success(request, 'Comment added!')
+        elif wants_json:
+            return JsonResponse({'errors': form.errors}, status=400)
+    elif wants_json:
+        return JsonResponse({'error': 'POST required.'}, status=405)
     return redirect(request.META.get('HTTP_REFERER', 'browse'))
 
 
+def _save_comment(comment):
+    with transaction.atomic():  # with Note.comment_count, adjusted on post_save
+        comment.save()
+
+
+async def _comment_count(note_id):
+    return await Note.objects.filter(id=note_id).values_list('comment_count', flat=True).aget()
+
+
 @login_required(login_url='login')
-def delete_comment(request, comment_id):
-    """Delete a comment (only the author can delete)."""
-    comment = get_object_or_404(Comment, id=comment_id)
-    if comment.user != request.user:
+async def delete_comment(request, comment_id):
+    """Delete a comment (only the author can delete). Answers fetch() calls as JSON."""
+    comment = await aget_object_or_404(Comment, id=comment_id)
+    user = await request.auser()
+    wants_json = _wants_json(request)
+    if comment.user_id != user.id:
+        if wants_json:
+            return JsonResponse({'error': 'You can only delete your own comments.'}, status=403)
         messages.error(request, 'You can only delete your own comments.')
     elif request.method == 'POST':
-        comment.delete()
+        await sync_to_async(_delete_comment)(comment)
+        if wants_json:
+            return JsonResponse({'deleted': comment_id, 'comment_count': await _comment_count(comment.note_id)})
         messages.success(request, 'Comment deleted.')
-    return redirect(request.META.get('HTTP_REFERER', 'browse'))
\ No newline at end of file
+    elif wants_json:
+        return JsonResponse({'error': 'POST required.'}, status=405)
+    return redirect(request.META.get('HTTP_REFERER', 'browse'))
+
+
+def _delete_comment(comment):
+    comment.delete()  # runs in a transaction, with Note.comment_count adjusted on post_delete
+
+
+def _metrics_allowed(request):
+    """Staff, a scraper with METRICS_TOKEN, or a METRICS_ALLOWED_IPS address (see settings)."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', []):
+        return True
+    return request.user.is_staff
+
+
+def metrics_view(request):
+    """Request metrics for all worker processes, in the Prometheus text format."""
+    if not _metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'studapp.middleware.RequestMetricsMiddleware',  # first, so its timing covers everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +60,8 @@ ROOT_URLCONF = 'studproject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's own backend, plus render timing for the request metrics
+        'BACKEND': 'studapp.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'studapp' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,6 +85,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock at BEGIN, so a transaction never fails half-way upgrading it
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Same file, opened read-only; read_only_view sends its queries here
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['studapp.routers.ReadOnlyRouter']
+DATABASE_READ_ALIAS = 'readonly'
+
+# SQLite pragmas applied to every connection (see studapp.dbprofile for the
+# defaults: busy_timeout, mmap and cache sizes). Set a pragma to None to skip it.
+# WAL is stored in the database file and is switched on once, by `migrate`.
+DATABASE_PROFILE = {}
+
+
+# Cache
+# A file-based cache is shared by every worker process on the host, so a
+# version bump in one worker (e.g. the navigation tree) is seen by all.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
     }
 }
 
@@ -142,5 +174,47 @@ X_FRAME_OPTIONS = 'SAMEORIGIN'
 # Email backend (console for development — prints reset links to terminal)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# File delivery for downloads and previews. None streams the file through
+# Django; 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) lets
+# the front-end server send it. For nginx, map the prefix to MEDIA_ROOT:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+FILE_DELIVERY_MODE = os.environ.get('FILE_DELIVERY_MODE') or None
+FILE_DELIVERY_INTERNAL_PREFIX = '/protected-media/'
+
+# Under ASGI (e.g. `uvicorn studproject.asgi:application`) files stream from
+# the event loop; each stream reads at most this many 64 KB chunks ahead
+STREAM_READ_AHEAD = 4
+
+# Text previews stream at most this much per page, with "Load more" after
+TEXT_PREVIEW_MAX_BYTES = 256 * 1024
+TEXT_PREVIEW_MAX_LINES = 5000
+TEXT_PREVIEW_FALLBACK_ENCODING = 'latin-1'  # for files that aren't UTF-8
+
 # Upload limits
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10 MB
+
+# Download counters are buffered in memory and written back this often (seconds)
+DOWNLOAD_COUNTER_FLUSH_INTERVAL = 5
+
+# Background jobs (thumbnails, text extraction) are run by `manage.py run_jobs`.
+# Eager mode runs each job inline as it is queued, for development without a worker.
+JOB_QUEUE_EAGER = False
+
+# Chunked uploads: largest chunk accepted per PUT, and how long an idle
+# session (and its partial file) is kept before purge_uploads removes it
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = 24
+
+# Text extracted from PDFs and text files for search (by the extract_text job)
+TEXT_EXTRACT_MAX_CHARS = 2_000_000
+
+# Request metrics (studapp.metrics). Each worker process writes its numbers
+# to METRICS_DIR; /metrics sums them. Staff can always see it; a scraper
+# sends "Authorization: Bearer <METRICS_TOKEN>" or comes from one of
+# METRICS_ALLOWED_IPS. That list checks REMOTE_ADDR, so behind a reverse
+# proxy (nginx, see FILE_DELIVERY_MODE) every client looks like the proxy:
+# only use it when the scraper reaches Django directly.
+METRICS_DIR = BASE_DIR / '.metrics'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = []